@@ -1,15 +1,18 @@
 #--- Python libs ---
 import os
+import glob
 import json
+import time
+import socket
 import logging 
+import threading
 import argparse
 import traceback 
-from hashlib import md5
 #--- Pip libs ---
 # import numpy as np
 import pandas as pd 
 #--- Custom libs ---
-from invasive_checker import invasive_checker, utils 
+from invasive_checker import invasive_checker, utils, tracing, provenance, planner, latency
 
 '''
 This APP takes an input csv file and checks each row of the 
@@ -26,6 +29,24 @@ Steps:
 '''
 log = logging.getLogger('main')  
 
+# Part of the DEADLINE kept for writing the outputs: lookups go cache-only after the rest
+DEADLINE_RESERVE = 0.1
+# A running spool job touches its <job>.json.running claim this often [s]...
+HEARTBEAT_INTERVAL = 30
+# ... and a claim not touched for this long [s] is taken to be left by a worker that died
+STALE_CLAIM_AFTER = 300
+# Jobs whose worker died this many times are not requeued again but marked failed
+MAX_JOB_ATTEMPTS = 2
+
+def sample_location(row):
+    '''
+    (lon, lat) of the sample of a row, 0 when it isn't known.
+    '''
+    lon = row.get('sampleLongitude') or row.get('Longitude') or row.get('longitude') or row.get('lon') or 0
+    lat = row.get('sampleLatitude') or row.get('Latitude') or row.get('latitude') or row.get('lat') or 0
+    return lon, lat
+
+@tracing.traced(attrs=lambda row: {'row': row.name, 'OTU': row.get('OTU'), 'AccessionID': row.get('AccessionID')})
 def process_input_row(row):
     '''
     Takes pandas/xarray input row and expands it with additional data
@@ -38,8 +59,7 @@ def process_input_row(row):
     log.info('Processing row {0}'.format(row.name) )
     log.debug('row: {0}'.format(row))
     sciname = row.get('classification')
-    lon = row.get('sampleLongitude') or row.get('Longitude') or row.get('longitude') or row.get('lon') or 0
-    lat = row.get('sampleLatitude') or row.get('Latitude') or row.get('latitude') or row.get('lat') or 0
+    lon, lat = sample_location(row)
 
     if lat == 0 and lon == 0:
         log.warning('Sample from Null Island! Lat=Lon=0')
@@ -57,7 +77,11 @@ def process_input_row(row):
     if row['isNegativeControlGene']:
         log.warning('Sample is Negative Control: not bothering with invasiveness check...')
     elif aphia_id is not None:
-        results, invasive_df = invasive_checker.check_aphia(lon, lat, aphia_id,source='worms')
+        if aphia_id == 'No Match':
+            # Nothing to look up the distribution of
+            results, invasive_df = None, None
+        else:
+            results, invasive_df = invasive_checker.check_aphia(lon, lat, aphia_id,source='worms')
         if (results is not None): 
             wrims_status = results.get('Status',['Unrecorded'])
             within = results.get('Within',['None'])
@@ -80,6 +104,42 @@ def process_input_row(row):
         # row['Details'] = json.dumps(invasive_dict, indent=2)
     return row
 
+def process_row(row, writer=None, deferred=None):
+    '''
+    process_input_row, plus what happened to its lookups in the 'Lookup Status' column:
+        - Complete: all lookups answered by WoRMS/MarineRegions or a fresh cached reply
+        - Unverified: some answers are older than the cache period (upstream down or deadline passed)
+        - Pending: some lookups were deferred because the run deadline passed. The status of
+          the row is 'Pending' instead of a possibly wrong 'Unrecorded', and the deferred urls
+          are added to the deferred list as (url, OTU, AccessionID).
+
+    With a provenance.TripleWriter the triples of the enriched row are written as soon as it is done.
+    '''
+    with invasive_checker.lookup_cache.track() as lookups:
+        row = process_input_row(row)
+
+    if lookups.deferred:
+        row['Lookup Status'] = 'Pending'
+        taxamatch = latency.endpoint(invasive_checker.taxamatch_url(''))
+        lineage_deferred = any(latency.endpoint(url) == taxamatch for url in lookups.deferred)
+        if lineage_deferred and row.get('Aphia_ID') == 'No Match':
+            row['Aphia_ID'] = 'Pending'
+            row['Worms SciName'] = 'Pending'
+            row['Worms SciName Rank'] = 'Pending'
+        if 'WRIMS Status at Sample Location' in row.index:
+            row['WRIMS Status at Sample Location'] = ['Pending']
+            row['MarineRegions with known occurrence at Sample Location'] = ['None']
+        if deferred is not None:
+            deferred.extend((url, row.get('OTU'), row.get('AccessionID')) for url in lookups.deferred)
+    elif lookups.stale:
+        row['Lookup Status'] = 'Unverified'
+    else:
+        row['Lookup Status'] = 'Complete'
+
+    if writer is not None:
+        writer.write_row(row)
+    return row
+
 def do_work(input_file, output_folder, meta_file, cfg):
     '''
     The meat and potatoes
@@ -97,31 +157,58 @@ def do_work(input_file, output_folder, meta_file, cfg):
     Output Files: 
         - to_rvlab.tsv 
         - classification.csv
+        - RDF_OUTPUT_FILE (optional): provenance triples, see provenance.py
+        - DEFERRED_OUTPUT_FILE: lookups deferred by the DEADLINE [s], if there were any
 
+    With a DEADLINE the lookups go cache-only once DEADLINE_RESERVE of the time budget is left.
+    '''
+    started = time.time()
+    if cfg.get('DEADLINE') not in (None, ''):
+        budget = float(cfg.get('DEADLINE'))
+        invasive_checker.lookup_cache.set_deadline(started + budget * (1 - DEADLINE_RESERVE))
+        log.info('  -Run deadline in {0}s, lookups go cache-only after {1:.0f}s'.format(budget, budget * (1 - DEADLINE_RESERVE)))
+    try:
+        process_files(input_file, output_folder, meta_file, cfg)
+    finally:
+        invasive_checker.lookup_cache.set_deadline(None)
+    log.info('  -Run took {0:.1f}s'.format(time.time() - started))
+
+def process_files(input_file, output_folder, meta_file, cfg):
+    '''
+    do_work without the deadline handling.
     '''
     log.info('  -Preparing data...')
 
+    md5s = {path: utils.file_md5(path) for path in (input_file, meta_file)}
     with open(f"{output_folder}/invasive_checker.log", "w", encoding="utf8") as f:
-        with open(input_file, "rb") as fi:
-            f.write(f"{md5(fi.read()).hexdigest()}\t(md5sum of {input_file})\n")
-        with open(meta_file, "rb") as fm:
-            f.write(f"{md5(fm.read()).hexdigest()}\t(md5sum of {meta_file})\n")
+        for path, md5sum in md5s.items():
+            f.write(f"{md5sum}\t(md5sum of {path})\n")
 
 
-    worms_df = pd.read_csv(input_file, sep = cfg.get('SEP'))
-    worms_df = clean_up_dataframes(worms_df, cfg)
-
-    worms_df_unpivot = pd.melt(worms_df, id_vars=['classification','OTU'],var_name='AccessionID', value_name='Count')
-    meta_df = pd.read_csv(meta_file) 
-    sample_df = utils.get_sample_location_df(worms_df_unpivot.AccessionID.unique(),meta_df)
-    worms_df_unpivot = pd.merge(worms_df_unpivot,sample_df,how="left",left_on='AccessionID',right_on='AccessionNumber')
-    
-    os.makedirs('/mnt/tests/output/', exist_ok=True)
+    worms_df, worms_df_unpivot = prepare_input(input_file, meta_file, cfg)
 
-    worms_df_unpivot.to_csv('/mnt/tests/output/unpivot.csv',index=False)
+    worms_df_unpivot.to_csv(os.path.join(output_folder, 'unpivot.csv'),index=False)
     log.info('  -Looping through rows...') 
-    wrims_df = worms_df_unpivot.apply(lambda row: process_input_row(row), axis=1)
-    wrims_df.to_csv('/mnt/tests/output/wrims_df.csv',index=False)
+    writer = None
+    if cfg.get('RDF_OUTPUT_FILE'):
+        writer = provenance.TripleWriter(os.path.join(output_folder, cfg.get('RDF_OUTPUT_FILE')), inputs=md5s)
+    deferred = []
+    buffer = cfg.get('BUFFER_KM')
+    try:
+        # The proximity lookups can still make a row Pending or Unverified, so with a buffer the
+        # triples of the rows (with their 'Lookup Status') are written once those are done
+        wrims_df = worms_df_unpivot.apply(lambda row: process_row(row, None if buffer else writer, deferred), axis=1)
+        if buffer:
+            log.info('  -Checking distance to introduced regions...')
+            wrims_df = add_proximity_columns(wrims_df, float(buffer), deferred)
+            if writer is not None:
+                for _, row in wrims_df.iterrows():
+                    writer.write_row(row)
+    finally:
+        if writer is not None:
+            writer.close()
+    write_deferred(deferred, os.path.join(output_folder, cfg.get('DEFERRED_OUTPUT_FILE')))
+    wrims_df.to_csv(os.path.join(output_folder, 'wrims_df.csv'),index=False)
 
     # Clean up table
     wrims_df = wrims_df.drop('AccessionNumber',axis=1)
@@ -149,6 +236,89 @@ def do_work(input_file, output_folder, meta_file, cfg):
     log.info('Writing full classification file to {0}'.format( filepath))
     wrims_df = wrims_df[wrims_df['Count'] > 0]
     wrims_df.to_csv(filepath,index=False)
+    log.info('Request latencies [s]: {0}'.format(json.dumps(invasive_checker.latency_budgets.snapshot(), indent=2)))
+
+def write_deferred(deferred, filepath):
+    '''
+    Write the deferred lookups, one row per url with the OTU/AccessionID rows that need it, so a
+    follow-up run (with the same CACHE_DIR) knows what is still to be filled in.
+    '''
+    if len(deferred) == 0:
+        return
+    # A row can defer the same url twice, e.g. a distribution both for its status and its proximity
+    deferred_df = pd.DataFrame(deferred, columns=['url', 'OTU', 'AccessionID']).drop_duplicates()
+    deferred_df = deferred_df.groupby('url', sort=False).agg(
+        rows=('url', 'size'),
+        OTU=('OTU', lambda values: ';'.join(sorted(set(str(value) for value in values.dropna())))),
+        AccessionID=('AccessionID', lambda values: ';'.join(sorted(set(str(value) for value in values.dropna()))))
+    ).reset_index()
+    log.warning('{0} lookups deferred by the deadline ({1} rows Pending), writing them to {2}'.format(
+        len(deferred_df), deferred_df['rows'].sum(), filepath))
+    deferred_df.to_csv(filepath, index=False)
+
+def prepare_input(input_file, meta_file, cfg):
+    '''
+    Read the input and metadata files. Returns the input dataframe with cleaned up column names,
+    and its unpivoted version with one row per (OTU, sample) and the sample location columns.
+    '''
+    worms_df = pd.read_csv(input_file, sep = cfg.get('SEP'))
+    worms_df = clean_up_dataframes(worms_df, cfg)
+
+    worms_df_unpivot = pd.melt(worms_df, id_vars=['classification','OTU'],var_name='AccessionID', value_name='Count')
+    meta_df = pd.read_csv(meta_file) 
+    sample_df = utils.get_sample_location_df(worms_df_unpivot.AccessionID.unique(),meta_df)
+    worms_df_unpivot = pd.merge(worms_df_unpivot,sample_df,how="left",left_on='AccessionID',right_on='AccessionNumber')
+    return worms_df, worms_df_unpivot
+
+def explain(input_file, meta_file, cfg):
+    '''
+    Dry run: read the input like do_work, work out the WoRMS/MarineRegions lookups it needs and
+    print how many are cached, how many upstream calls are left and how long they would take at
+    the current rate limits. No requests are made and no output files are written.
+    '''
+    _, worms_df_unpivot = prepare_input(input_file, meta_file, cfg)
+    plan = planner.LookupPlan()
+    for _, row in worms_df_unpivot.iterrows():
+        lon, lat = sample_location(row)
+        plan.add_row(row.get('classification'), lon, lat, row['isNegativeControlGene'])
+    report = plan.report()
+    print(report)
+    return plan
+
+def add_proximity_columns(wrims_df, buffer, deferred=None):
+    '''
+    Add the proximity fields of check_aphia (within <buffer> km of the distribution, distance to
+    and MRGID of the nearest introduced region) to the rows with an AphiaID and sample location.
+    All sample locations of an AphiaID are handled in one go. The columns are always added; they
+    are empty for rows without a value.
+
+    The lookups count towards the 'Lookup Status' of the rows, as in process_row: if any lookup
+    of an AphiaID was deferred its rows are Pending, without proximity fields, and the deferred
+    urls are added to the deferred list for each of them.
+    '''
+    proximity = {}
+    groups = {}
+    if 'Aphia_ID' in wrims_df.columns:
+        aphia_ids = pd.to_numeric(wrims_df['Aphia_ID'], errors='coerce')
+        lons = pd.to_numeric(wrims_df['longitude'], errors='coerce')
+        lats = pd.to_numeric(wrims_df['latitude'], errors='coerce')
+        has_location = aphia_ids.notna() & lons.notna() & lats.notna()
+        groups = wrims_df[has_location].groupby(aphia_ids[has_location]).groups
+
+    for aphia_id, index in groups.items():
+        with invasive_checker.lookup_cache.track() as lookups:
+            results = invasive_checker.get_proximity(lons[index].values, lats[index].values, int(aphia_id), buffer)
+        if lookups.deferred:
+            wrims_df.loc[index, 'Lookup Status'] = 'Pending'
+            if deferred is not None:
+                deferred.extend((url, wrims_df.at[row, 'OTU'], wrims_df.at[row, 'AccessionID'])
+                                for row in index for url in lookups.deferred)
+            continue
+        if lookups.stale:
+            complete = index[wrims_df.loc[index, 'Lookup Status'] == 'Complete']
+            wrims_df.loc[complete, 'Lookup Status'] = 'Unverified'
+        proximity.update(zip(index, results))
+    return wrims_df.join(pd.DataFrame.from_dict(proximity, orient='index', columns=invasive_checker.PROXIMITY_FIELDS))
 
 # take a dataframe and change several column names to match column names defined in the cfg file
 def clean_up_dataframes(df, cfg):
@@ -179,9 +349,154 @@ def get_config():
             'OTU_COL_NAME':os.getenv('OTU_COL_NAME', 'OTU'),
             'CLASS_COL_NAME':os.getenv('CLASS_COL_NAME', 'classification'),
             'CLASS_OUTPUT_FILE':os.getenv('CLASS_OUTPUT_FILE', 'classification.csv'),
-            'WORMS_OUTPUT_FILE':os.getenv('WORMS_OUTPUT_FILE', 'worms.csv'),}
+            'WORMS_OUTPUT_FILE':os.getenv('WORMS_OUTPUT_FILE', 'worms.csv'),
+            'BUFFER_KM':os.getenv('BUFFER_KM'),
+            'TRACE_FILE':os.getenv('TRACE_FILE'),
+            'RDF_OUTPUT_FILE':os.getenv('RDF_OUTPUT_FILE'),
+            'DEADLINE':os.getenv('DEADLINE'),
+            'DEFERRED_OUTPUT_FILE':os.getenv('DEFERRED_OUTPUT_FILE', 'deferred_lookups.csv'),}
     return cfg
 
+def write_marker(path, content):
+    '''
+    Write a json marker file atomically: readers see either no file or the complete file.
+    '''
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        json.dump(content, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+def process_job(manifest_path, cfg):
+    '''
+    Run do_work for one job manifest from the spool folder. The manifest is a json file:
+        {"input_file": ..., "meta_file": ..., "output_folder": ..., "cfg": {<optional overrides>}}
+
+    The manifest is first claimed by renaming it to <job>.json.running, so several workers can
+    share one spool folder. While the job runs the claim is touched every HEARTBEAT_INTERVAL, see
+    recover_stale_claims. When the job ends <job>.done or <job>.failed is written next to it.
+    Returns False if another worker claimed the job first. A job whose claim was taken from it
+    while it ran (see recover_stale_claims) still gets its marker, and is run again.
+    '''
+    job = manifest_path[:-len('.json')]
+    running_path = manifest_path + '.running'
+    try:
+        os.rename(manifest_path, running_path)
+        # The rename keeps the mtime of the manifest, which may have waited in the spool for
+        # longer than STALE_CLAIM_AFTER: touch the claim before anyone takes it for stale
+        os.utime(running_path)
+    except FileNotFoundError:
+        return False
+
+    started = time.time()
+    marker = {'manifest': os.path.basename(manifest_path),
+              'worker': '{0}:{1}'.format(socket.gethostname(), os.getpid()),
+              'started': started}
+    stop = threading.Event()
+    threading.Thread(target=keep_claim, args=(running_path, stop), daemon=True).start()
+    try:
+        with open(running_path, encoding='utf8') as f:
+            manifest = json.load(f)
+        marker.update(manifest)
+        log.info('Starting job {0}'.format(job))
+        job_cfg = dict(cfg, **manifest.get('cfg', {}))
+        os.makedirs(manifest['output_folder'], exist_ok=True)
+        do_work(manifest['input_file'], manifest['output_folder'], manifest['meta_file'], job_cfg)
+        marker['status'] = 'done'
+    except Exception as error:
+        log.error('Job {0} failed'.format(job))
+        log.error(traceback.format_exc())
+        marker['status'] = 'failed'
+        marker['error'] = repr(error)
+    finally:
+        stop.set()
+    marker['finished'] = time.time()
+    marker['duration_s'] = round(marker['finished'] - started, 3)
+    write_marker('{0}.{1}'.format(job, marker['status']), marker)
+    try:
+        os.remove(running_path)
+    except FileNotFoundError:
+        log.warning('Job {0} lost its claim while running, another worker requeued it'.format(job))
+    log.info('Job {0} {1} in {2}s'.format(job, marker['status'], marker['duration_s']))
+    return True
+
+def keep_claim(running_path, stop, interval=None):
+    '''
+    Touch the claim of a running job every HEARTBEAT_INTERVAL until stop is set.
+    '''
+    while not stop.wait(interval or HEARTBEAT_INTERVAL):
+        try:
+            os.utime(running_path)
+        except FileNotFoundError:
+            return
+
+def recover_stale_claims(spool_folder, stale_after=STALE_CLAIM_AFTER):
+    '''
+    Requeue the jobs of workers that died: a <job>.json.running claim that hasn't been touched
+    for stale_after seconds is put back as <job>.json, with its attempts counted in the manifest.
+    After MAX_JOB_ATTEMPTS the job is marked failed instead, so a job that kills its worker
+    doesn't take down every worker in turn. Returns the number of claims recovered.
+    '''
+    recovered = 0
+    for running_path in glob.glob(os.path.join(spool_folder, '*.json.running')):
+        try:
+            if time.time() - os.path.getmtime(running_path) < stale_after:
+                continue
+            # Claim the recovery too, in case other workers found the same stale claim
+            recovering_path = '{0}.recovering.{1}'.format(running_path, os.getpid())
+            os.rename(running_path, recovering_path)
+        except FileNotFoundError:
+            continue
+        manifest_path = running_path[:-len('.running')]
+        job = manifest_path[:-len('.json')]
+        with open(recovering_path, encoding='utf8') as f:
+            manifest = json.load(f)
+        manifest['attempts'] = manifest.get('attempts', 0) + 1
+        if manifest['attempts'] >= MAX_JOB_ATTEMPTS:
+            log.error('Job {0}: worker died {1} times, giving up'.format(job, manifest['attempts']))
+            marker = dict(manifest, manifest=os.path.basename(manifest_path), status='failed',
+                          error='Worker died while running the job', finished=time.time())
+            write_marker('{0}.failed'.format(job), marker)
+        else:
+            log.warning('Job {0}: worker died, requeueing it'.format(job))
+            write_marker(manifest_path, manifest)
+        os.remove(recovering_path)
+        recovered += 1
+    return recovered
+
+def spool_manifests(spool_folder):
+    '''
+    The *.json job manifests in the spool folder, oldest first. Manifests that other workers
+    claim while we list them are skipped.
+    '''
+    manifests = []
+    for manifest_path in glob.glob(os.path.join(spool_folder, '*.json')):
+        try:
+            manifests.append((os.path.getmtime(manifest_path), manifest_path))
+        except FileNotFoundError:
+            continue
+    return [manifest_path for _, manifest_path in sorted(manifests)]
+
+def run_spool(spool_folder, cfg, poll_interval=5):
+    '''
+    Long-lived worker: keep picking up *.json job manifests from the spool folder (oldest first)
+    and run them in this process, so imports and the lookup caches stay warm between jobs.
+    Write manifests as <job>.json.tmp and rename them to <job>.json so they are never read half written.
+    Jobs left running by workers that died are requeued (see recover_stale_claims).
+    '''
+    log.info('Watching {0} for jobs...'.format(spool_folder))
+    while True:
+        recover_stale_claims(spool_folder)
+        manifests = spool_manifests(spool_folder)
+        for manifest_path in manifests:
+            try:
+                process_job(manifest_path, cfg)
+            except Exception:
+                # Keep the worker up for the other jobs
+                log.error('Could not process {0}'.format(manifest_path))
+                log.error(traceback.format_exc())
+        if len(manifests) == 0:
+            time.sleep(poll_interval)
+
 def main(args):
     '''
     Setup logging, and args, then "do_work" via a scheduler
@@ -191,11 +506,19 @@ def main(args):
                         level=getattr(logging, loglevel))    
     try: 
         cfg = get_config() 
-        log.info('Input file: {0}'.format(args.input_file))
-        log.info('Output folder: {0}'.format(args.output_folder))
-        log.info('Input metadata File: {0}'.format(args.meta_file))
+        if args.deadline is not None:
+            cfg['DEADLINE'] = args.deadline
         log.info('Extra config: {0}'.format(json.dumps(cfg, indent=2)))
-        do_work(args.input_file, args.output_folder, args.meta_file, cfg)
+        tracing.configure(cfg.get('TRACE_FILE'))
+        if args.spool_folder:
+            run_spool(args.spool_folder, cfg, args.poll_interval)
+        elif args.explain:
+            explain(args.input_file, args.meta_file, cfg)
+        else:
+            log.info('Input file: {0}'.format(args.input_file))
+            log.info('Output folder: {0}'.format(args.output_folder))
+            log.info('Input metadata File: {0}'.format(args.meta_file))
+            do_work(args.input_file, args.output_folder, args.meta_file, cfg)
     except (KeyboardInterrupt, SystemExit):
         log.warning('Exiting script...')
         pass
@@ -221,6 +544,18 @@ if __name__ == "__main__":
     PARSER.add_argument(
         '-o', '--output_folder', default='/mnt/',
         help="Path to folder to write output files.")
+    PARSER.add_argument(
+        '-s', '--spool_folder', default=None,
+        help="Run as a worker that processes the job manifests put in this folder.")
+    PARSER.add_argument(
+        '--poll_interval', default=5, type=float,
+        help="Seconds between checks of the spool folder for new jobs.")
+    PARSER.add_argument(
+        '--deadline', default=None, type=float,
+        help="Time budget of the run [s]. Near the end lookups are answered from the cache only, the rest is deferred.")
+    PARSER.add_argument(
+        '--explain', action='store_true',
+        help="Only print the lookups the run needs, how many are cached and the projected run time. No requests are made.")
     ARGS = PARSER.parse_args()
     try:
         main(ARGS)
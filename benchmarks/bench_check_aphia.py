@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+'''
+Microbenchmark of check_aphia with and without the details dataframe.
+
+The WoRMS/MarineRegions replies are canned so that only the local evaluation is timed,
+which is what a service sees once the lookups are cached.
+
+    PYTHONPATH=. python benchmarks/bench_check_aphia.py [n_records] [n_calls]
+'''
+import sys
+import timeit
+import logging
+
+from invasive_checker import invasive_checker
+
+
+class CannedReply:
+    status_code = 200
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+def canned_requester(n_records):
+    distribution = [{'locality': f'Region {i}',
+                     'locationID': f'http://marineregions.org/mrgid/{1000 + i}',
+                     'higherGeography': None,
+                     'higherGeographyID': None,
+                     'recordStatus': 'valid' if i % 10 else 'deleted',
+                     'typeStatus': None,
+                     'establishmentMeans': ['Alien', None, 'Native'][i % 3],
+                     'decimalLatitude': None,
+                     'decimalLongitude': None,
+                     'qualityStatus': 'checked'} for i in range(n_records)]
+    sample_mrgids = [{'MRGID': 1000 + i} for i in range(0, n_records, 7)]
+
+    def requester(url):
+        if 'AphiaDistributionsByAphiaID' in url:
+            return CannedReply(distribution)
+        return CannedReply(sample_mrgids)
+    return requester
+
+
+def main(n_records=50, n_calls=2000):
+    logging.disable(logging.WARNING)
+    invasive_checker.requester = canned_requester(n_records)
+    assert (invasive_checker.check_aphia(2.5, 51.5, 1)[0] ==
+            invasive_checker.check_aphia(2.5, 51.5, 1, details=False)[0])
+
+    print(f'check_aphia, {n_records} distribution records, {n_calls} calls:')
+    for details in (True, False):
+        seconds = min(timeit.repeat(lambda: invasive_checker.check_aphia(2.5, 51.5, 1, details=details),
+                                    number=n_calls, repeat=3))
+        print(f'  details={details!s:<5}  {1e6 * seconds / n_calls:9.1f} us/call')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,349 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import contextlib
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from invasive_checker import tracing
+
+log = logging.getLogger('cache')
+
+# Replies that say something about the lookup itself, so are worth keeping. Anything else
+# (5xx, 429 after all retries, connection errors) is an UpstreamError and is never cached.
+CACHEABLE_STATUS = (200, 204, 400, 404)
+
+_lookups = contextvars.ContextVar('lookups', default=None)
+
+
+class UpstreamError(Exception):
+    '''
+    WoRMS/MarineRegions could not give a usable reply.
+    '''
+
+
+class Deferred(UpstreamError):
+    '''
+    The lookup wasn't made because it can't be done before the run deadline.
+    '''
+
+
+class CachedReply:
+    '''
+    The parts of a requests.Response that the lookups use, small enough to keep around and
+    to write to disk. stale is True when the reply is older than the cache period.
+    '''
+
+    def __init__(self, url, status_code, text, fetched_at=None, stale=False):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+        self.stale = stale
+
+    @classmethod
+    def from_response(cls, response):
+        return cls(response.url, response.status_code, response.text)
+
+    def json(self):
+        return json.loads(self.text)
+
+    def as_stale(self):
+        return CachedReply(self.url, self.status_code, self.text, self.fetched_at, stale=True)
+
+    def __repr__(self):
+        return '<CachedReply [{0}]{1}>'.format(self.status_code, ' stale' if self.stale else '')
+
+
+class Lookups:
+    '''
+    What happened to the lookups made inside LookupCache.track(): urls answered with an expired
+    reply (stale) and urls not looked up at all because the deadline had passed (deferred).
+    '''
+
+    def __init__(self):
+        self.stale = []
+        self.deferred = []
+
+
+class LookupCache:
+    '''
+    Cache of WoRMS/MarineRegions replies, by url, with a refresh-ahead policy:
+
+      - replies are fresh for ttl seconds (CACHE_PERIOD days)
+      - a fresh reply that is used often (hot_hits uses) and is in the last refresh_ahead
+        part of its ttl is re-fetched in the background, so hot entries never expire in the
+        request path
+      - an expired reply of a hot entry is served (stale) while it is revalidated in the
+        background; other expired replies are re-fetched in the request path
+      - if the upstream can't be reached the expired reply is served, stale, instead of failing
+
+    With a folder the replies are also written to disk, so they survive restarts.
+
+    At most max_entries replies (and max_bytes of reply text, if set) are kept in memory; the
+    least recently used ones are dropped first. Dropped replies are still on disk with a folder.
+    Concurrent misses on the same url share one fetch.
+
+    clock() gives the current time [epoch seconds] for ages and the deadline.
+
+    After the deadline (epoch seconds, see set_deadline) nothing is fetched any more: cached
+    replies are served whatever their age, and lookups that aren't cached are deferred.
+    '''
+
+    def __init__(self, ttl=7 * 86400, refresh_ahead=0.2, hot_hits=3, folder=None, workers=2,
+                 max_entries=100000, max_bytes=None, clock=time.time):
+        self.ttl = float(ttl)
+        self.refresh_ahead = float(refresh_ahead)
+        self.hot_hits = int(hot_hits)
+        self.folder = folder
+        if self.folder is not None:
+            os.makedirs(self.folder, exist_ok=True)
+        self.max_entries = int(max_entries)
+        self.max_bytes = int(max_bytes) if max_bytes else None
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._hits = {}
+        self._bytes = 0
+        self._refreshing = set()
+        self._inflight = {}
+        self.deadline = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='revalidate')
+
+    # ---- storage ----
+    def _path(self, url):
+        return os.path.join(self.folder, hashlib.sha1(url.encode('utf8')).hexdigest() + '.json')
+
+    def _load(self, url):
+        if self.folder is None:
+            return None
+        try:
+            with open(self._path(url), encoding='utf8') as f:
+                stored = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return CachedReply(stored['url'], stored['status_code'], stored['text'], stored['fetched_at'])
+
+    def _keep(self, url, reply):
+        '''
+        Put reply in memory as the most recently used entry and drop the least recently used
+        ones that don't fit any more. Call with the lock held.
+        '''
+        old = self._entries.pop(url, None)
+        if old is not None:
+            self._bytes -= len(old.text)
+        self._entries[url] = reply
+        self._bytes += len(reply.text)
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or
+                                          (self.max_bytes is not None and self._bytes > self.max_bytes)):
+            cold_url, cold = self._entries.popitem(last=False)
+            self._hits.pop(cold_url, None)
+            self._bytes -= len(cold.text)
+
+    def _store(self, url, reply):
+        with self._lock:
+            self._keep(url, reply)
+            self._hits[url] = 0
+        if self.folder is not None:
+            path = self._path(url)
+            tmp_path = '{0}.{1}.{2}.tmp'.format(path, os.getpid(), threading.get_ident())
+            with open(tmp_path, 'w', encoding='utf8') as f:
+                json.dump({'url': url,
+                           'status_code': reply.status_code,
+                           'fetched_at': reply.fetched_at,
+                           'text': reply.text}, f)
+            os.replace(tmp_path, path)
+
+    def peek(self, url):
+        '''
+        The cached reply for url (fresh or not) without fetching anything, or None.
+        '''
+        with self._lock:
+            reply = self._entries.get(url)
+            if reply is not None:
+                self._entries.move_to_end(url)
+        if reply is None:
+            reply = self._load(url)
+            if reply is not None:
+                with self._lock:
+                    if url not in self._entries:
+                        self._keep(url, reply)
+                        self._hits.setdefault(url, 0)
+        return reply
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._hits.clear()
+            self._bytes = 0
+
+    def set_deadline(self, deadline):
+        '''
+        Go cache-only at deadline (epoch seconds). None lifts the deadline.
+        '''
+        self.deadline = deadline
+
+    @property
+    def cache_only(self):
+        return self.deadline is not None and self.clock() >= self.deadline
+
+    def remaining(self):
+        '''
+        Seconds left until the deadline (0 once it has passed), None without a deadline.
+        '''
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - self.clock())
+
+    # ---- lookups ----
+    @contextlib.contextmanager
+    def track(self):
+        '''
+        Collect what happens to the lookups made inside the block (in this thread/context):
+
+            with lookup_cache.track() as lookups:
+                ...
+            if lookups.stale: ...
+
+        Blocks can be nested; the outer block also gets what happened in the inner one.
+        '''
+        parent = _lookups.get()
+        lookups = Lookups()
+        token = _lookups.set(lookups)
+        try:
+            yield lookups
+        finally:
+            _lookups.reset(token)
+            if parent is not None:
+                parent.stale.extend(lookups.stale)
+                parent.deferred.extend(lookups.deferred)
+
+    def _fetch(self, url, fetch):
+        '''
+        fetch(url) and store the reply. If url is already being fetched, wait for that reply (or
+        error) instead of requesting it again.
+        '''
+        with self._lock:
+            pending = self._inflight.get(url)
+            if pending is None:
+                future = self._inflight[url] = Future()
+        if pending is not None:
+            # Also raises when the fetch failed or was deferred, for this caller too
+            return pending.result()
+        try:
+            reply = fetch(url)
+            reply.fetched_at = self.clock()
+            self._store(url, reply)
+            future.set_result(reply)
+            return reply
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[url]
+
+    def _revalidate(self, url, fetch):
+        '''
+        Re-fetch url in the background, unless that is already happening.
+        '''
+        with self._lock:
+            if url in self._refreshing:
+                return
+            self._refreshing.add(url)
+
+        def refresh():
+            try:
+                self._fetch(url, fetch)
+                log.debug(f'Revalidated {url}')
+            except Exception as error:
+                log.warning(f'Could not revalidate {url}: {error}')
+            finally:
+                with self._lock:
+                    self._refreshing.discard(url)
+        self._executor.submit(refresh)
+
+    def _serve_stale(self, url, reply):
+        log.warning(f'Serving stale reply for {url} (fetched {time.ctime(reply.fetched_at)})')
+        tracing.annotate(cache='stale')
+        lookups = _lookups.get()
+        if lookups is not None:
+            lookups.stale.append(url)
+        return reply.as_stale()
+
+    def defer(self, url):
+        '''
+        Give up on the lookup of url because of the deadline: it is recorded in the tracked
+        lookups (see track) and Deferred is raised. fetch functions raise Deferred themselves
+        when the lookup can't be made before the deadline; get records it with this only when
+        it has no stale reply to serve instead.
+        '''
+        log.warning(f'Deadline passed, deferring {url}')
+        tracing.annotate(cache='deferred')
+        lookups = _lookups.get()
+        if lookups is not None:
+            lookups.deferred.append(url)
+        raise Deferred(f'Deferred {url}: past the run deadline and not cached')
+
+    def get(self, url, fetch):
+        '''
+        The reply for url, from the cache when possible. fetch(url) does the actual request: it
+        returns a CachedReply or raises UpstreamError. Past the deadline uncached lookups raise
+        Deferred.
+        '''
+        reply = self.peek(url)
+        if self.cache_only:
+            if reply is None:
+                self.defer(url)
+            if self.clock() - reply.fetched_at >= self.ttl:
+                return self._serve_stale(url, reply)
+            return reply
+        if reply is None:
+            try:
+                return self._fetch(url, fetch)
+            except Deferred:
+                self.defer(url)
+
+        with self._lock:
+            self._hits[url] = self._hits.get(url, 0) + 1
+            hot = self._hits[url] >= self.hot_hits
+            refreshing = url in self._refreshing
+        age = self.clock() - reply.fetched_at
+
+        if age < self.ttl:
+            if hot and age > self.ttl * (1 - self.refresh_ahead):
+                self._revalidate(url, fetch)
+            return reply
+
+        if refreshing:
+            return self._serve_stale(url, reply)
+        if hot:
+            self._revalidate(url, fetch)
+            return self._serve_stale(url, reply)
+        try:
+            return self._fetch(url, fetch)
+        except UpstreamError as error:
+            # Also when the refetch was deferred: the stale reply is served, nothing is deferred
+            log.warning(error)
+            return self._serve_stale(url, reply)
+
+
+def from_env():
+    '''
+    LookupCache with the CACHE_PERIOD [days], CACHE_REFRESH_AHEAD, CACHE_HOT_HITS, CACHE_DIR,
+    CACHE_MAX_ENTRIES and CACHE_MAX_MB env variables.
+    '''
+    max_mb = os.getenv('CACHE_MAX_MB')
+    return LookupCache(ttl=float(os.getenv('CACHE_PERIOD', 7)) * 86400,
+                       refresh_ahead=float(os.getenv('CACHE_REFRESH_AHEAD', 0.2)),
+                       hot_hits=int(os.getenv('CACHE_HOT_HITS', 3)),
+                       folder=os.getenv('CACHE_DIR') or None,
+                       max_entries=int(os.getenv('CACHE_MAX_ENTRIES', 100000)),
+                       max_bytes=float(max_mb) * 2 ** 20 if max_mb else None)
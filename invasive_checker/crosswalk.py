@@ -0,0 +1,113 @@
+import os
+import re
+import logging
+import threading
+
+import pandas as pd
+
+log = logging.getLogger('crosswalk')
+
+
+def normalise_id(external_id):
+    '''
+    External IDs are compared as strings; 860360, 860360.0, '860360.0' and ' 860360' are all
+    '860360'.
+    '''
+    if isinstance(external_id, float) and external_id.is_integer():
+        external_id = int(external_id)
+    return re.sub(r'^(\d+)\.0*$', r'\1', str(external_id).strip())
+
+
+class Crosswalk:
+    '''
+    Local table of external IDs (NCBI taxids, BOLD TaxIDs, ...) -> AphiaID.
+
+    Lets a run resolve thousands of external IDs without a WoRMS request each. Load it from a
+    WoRMS export, e.g. for an NCBI export with "ncbi_id" and "AphiaID" columns:
+
+        crosswalk = Crosswalk.from_csv('worms_ncbi.csv', id_source='ncbi', id_col='ncbi_id')
+
+    or from a table written by to_csv, which has external_id, source and AphiaID columns.
+    IDs are compared as strings (see normalise_id), so 860360 and '860360' are the same taxon.
+
+    path is the file save() writes back to; from_env sets it to ID_CROSSWALK.
+    '''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.table = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, pair):
+        external_id, id_source = pair
+        return (id_source, normalise_id(external_id)) in self.table
+
+    def get(self, external_id, id_source):
+        return self.table.get((id_source, normalise_id(external_id)))
+
+    def add(self, external_id, id_source, aphia_id):
+        with self._lock:
+            self.table[(id_source, normalise_id(external_id))] = int(aphia_id)
+
+    def load_csv(self, path, id_source=None, id_col='external_id', source_col='source', aphia_col='AphiaID', sep=','):
+        '''
+        Add the rows of a csv file. With id_source all rows are taken to be from that source,
+        otherwise the source is read from source_col. Rows without an AphiaID are skipped.
+        '''
+        df = pd.read_csv(path, sep=sep, dtype=str)
+        df = df[df[id_col].notna() & df[aphia_col].notna()]
+        sources = [id_source] * len(df) if id_source is not None else df[source_col]
+        with self._lock:
+            for external_id, source, aphia_id in zip(df[id_col].map(normalise_id), sources, df[aphia_col]):
+                self.table[(source, external_id)] = int(float(aphia_id))
+        log.info(f'Loaded {len(df)} external IDs from {path}')
+
+    @classmethod
+    def from_csv(cls, path, **kwargs):
+        crosswalk = cls()
+        crosswalk.load_csv(path, **kwargs)
+        return crosswalk
+
+    def to_csv(self, path, sep=','):
+        with self._lock:
+            rows = [{'external_id': external_id, 'source': source, 'AphiaID': aphia_id}
+                    for (source, external_id), aphia_id in self.table.items()]
+        pd.DataFrame(rows, columns=['external_id', 'source', 'AphiaID']).to_csv(path, sep=sep, index=False)
+
+    def save(self, path=None):
+        '''
+        Write the crosswalk to path (default self.path). IDs that another process added to the
+        file in the meantime are kept, and the file is replaced in one go so readers never see
+        half of it.
+        '''
+        path = path or self.path
+        if path is None:
+            return
+        if os.path.exists(path):
+            stored = Crosswalk.from_csv(path)
+            with self._lock:
+                for key, aphia_id in stored.table.items():
+                    self.table.setdefault(key, aphia_id)
+        tmp_file = f'{path}.{os.getpid()}.tmp'
+        self.to_csv(tmp_file)
+        os.replace(tmp_file, path)
+        log.info(f'Saved {len(self)} external IDs to {path}')
+
+
+def from_env():
+    '''
+    The Crosswalk in the ID_CROSSWALK csv file (external_id, source, AphiaID columns), or None
+    when ID_CROSSWALK isn't set.
+    '''
+    path = os.getenv('ID_CROSSWALK')
+    if not path:
+        return None
+    crosswalk = Crosswalk(path)
+    if not os.path.exists(path):
+        log.warning(f'ID_CROSSWALK file {path} not found, starting an empty crosswalk...')
+        return crosswalk
+    crosswalk.load_csv(path)
+    return crosswalk
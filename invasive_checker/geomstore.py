@@ -0,0 +1,185 @@
+import os
+import json
+import mmap
+import logging
+import threading
+import contextlib
+from collections.abc import Mapping
+
+import shapely
+
+from invasive_checker.proximity import ProximityEngine
+
+try:
+    import fcntl
+except ImportError:  # Windows: single writer only
+    fcntl = None
+
+log = logging.getLogger('geomstore')
+
+# Simplification tolerances [deg] of the coarse levels, coarsest first. Full resolution is
+# always stored as the last level (tolerance 0).
+LEVELS = (0.1, 0.01)
+
+
+class GeometryStore:
+    '''
+    On-disk store of MarineRegions geometries keyed by MRGID.
+
+    Every geometry is kept as WKB at full resolution and at the simplified LEVELS. The WKB is
+    appended to one data file that readers memory-map, so any number of worker processes share
+    the same pages through the OS page cache instead of each holding their own parsed copies
+    of multi-megabyte EEZs:
+
+        <path>/geoms.bin   - WKB blobs
+        <path>/index.json  - {MRGID: [[tolerance, offset, length], ...]} coarsest level first
+
+    A simplified level is never further than its tolerance from the full geometry, which is
+    what makes the coarse levels safe for rejecting points that are clearly inside, outside or
+    far away; only the borderline cases need the full resolution.
+    '''
+
+    def __init__(self, path, levels=LEVELS):
+        self.path = path
+        self.levels = tuple(sorted(levels, reverse=True))
+        os.makedirs(path, exist_ok=True)
+        self.data_file = os.path.join(path, 'geoms.bin')
+        self.index_file = os.path.join(path, 'index.json')
+        self.lock_file = os.path.join(path, '.lock')
+        self._lock = threading.Lock()
+        self._index = {}
+        self._index_mtime = None
+        self._mmap = None
+        self._reload_index()
+
+    # ---- reading ----
+    def _reload_index(self):
+        try:
+            mtime = os.stat(self.index_file).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._index_mtime:
+            return
+        with open(self.index_file, encoding='utf8') as f:
+            self._index = {int(mrgid): levels for mrgid, levels in json.load(f).items()}
+        self._index_mtime = mtime
+
+    def _read(self, offset, length):
+        '''
+        Read a WKB blob from the memory map of the data file, remapping it first if the file has
+        grown since it was mapped.
+        '''
+        with self._lock:
+            if self._mmap is None or len(self._mmap) < offset + length:
+                if self._mmap is not None:
+                    self._mmap.close()
+                with open(self.data_file, 'rb') as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._mmap[offset:offset + length]
+
+    def __contains__(self, mrgid):
+        if mrgid not in self._index:
+            self._reload_index()
+        return mrgid in self._index
+
+    def __len__(self):
+        self._reload_index()
+        return len(self._index)
+
+    def get(self, mrgid, level=None):
+        '''
+        The geometry of mrgid at a level (index into self.levels, coarsest first) or at full
+        resolution when level is None. None if the MRGID is not in the store.
+        '''
+        if mrgid not in self:
+            return None
+        entries = self._index[mrgid]
+        _, offset, length = entries[-1] if level is None else entries[level]
+        return shapely.from_wkb(self._read(offset, length))
+
+    def geometries(self, mrgids, level=None):
+        '''
+        Lazy {MRGID: geometry} view: a geometry is only read when it is accessed.
+        '''
+        return StoreView(self, [mrgid for mrgid in mrgids if mrgid in self], level)
+
+    def engine(self, mrgids, level=0):
+        '''
+        ProximityEngine over the mrgids that works on a coarse level and only reads the
+        full geometries of borderline candidates.
+        '''
+        return ProximityEngine(self.geometries(mrgids),
+                               coarse=self.geometries(mrgids, level),
+                               coarse_error=self.levels[level])
+
+    # ---- writing ----
+    @contextlib.contextmanager
+    def _writing(self):
+        with self._lock:
+            with open(self.lock_file, 'a') as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def put(self, mrgid, geom):
+        '''
+        Add a geometry at full resolution plus all simplified levels.
+        '''
+        blobs = [(tolerance, shapely.to_wkb(shapely.simplify(geom, tolerance, preserve_topology=True)))
+                 for tolerance in self.levels]
+        blobs.append((0.0, shapely.to_wkb(geom)))
+        with self._writing():
+            entries = []
+            with open(self.data_file, 'ab') as f:
+                offset = f.seek(0, os.SEEK_END)
+                for tolerance, blob in blobs:
+                    f.write(blob)
+                    entries.append([tolerance, offset, len(blob)])
+                    offset += len(blob)
+
+            # Other processes may have added geometries since we last read the index
+            self._index_mtime = None
+            self._reload_index()
+            self._index[mrgid] = entries
+            tmp_file = f'{self.index_file}.{os.getpid()}.tmp'
+            with open(tmp_file, 'w', encoding='utf8') as f:
+                json.dump(self._index, f)
+            os.replace(tmp_file, self.index_file)
+        log.debug(f'Stored geometry of MRGID {mrgid} ({len(blobs[-1][1])} bytes WKB)')
+
+
+class StoreView(Mapping):
+    '''
+    Read-only {MRGID: geometry} mapping backed by a GeometryStore level.
+    '''
+
+    def __init__(self, store, mrgids, level=None):
+        self.store = store
+        self.mrgids = list(mrgids)
+        self._mrgids = set(self.mrgids)
+        self.level = level
+
+    def __getitem__(self, mrgid):
+        if mrgid not in self._mrgids:
+            raise KeyError(mrgid)
+        return self.store.get(mrgid, self.level)
+
+    def __iter__(self):
+        return iter(self.mrgids)
+
+    def __len__(self):
+        return len(self.mrgids)
+
+
+def from_env():
+    '''
+    The GeometryStore in the GEOM_STORE folder, or None when GEOM_STORE isn't set.
+    '''
+    path = os.getenv('GEOM_STORE')
+    if not path:
+        return None
+    return GeometryStore(path)
@@ -8,6 +8,9 @@ import os
 import json
 import functools
 import logging
+import threading
+import collections
+import contextvars
 import shapely
 import math
 import warnings
@@ -15,14 +18,56 @@ from shapely.errors import ShapelyDeprecationWarning
 from shapely.geometry import Point, Polygon
 from shapely.ops import nearest_points
 import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from rdflib import Graph 
 from rdflib.namespace import RDF 
+from rdflib.namespace import GEO as GSP
+
+from invasive_checker import ratelimit, latency, geomstore, crosswalk, tracing, cache
+from invasive_checker.proximity import ProximityEngine
 
 warnings.filterwarnings("ignore", category=ShapelyDeprecationWarning)
 
 log = logging.getLogger('invasive_checker') 
 
+# Shared by every request to WoRMS/MarineRegions, one token bucket per host
+limiter = ratelimit.from_env()
+MAX_RETRIES = int(os.getenv('MAX_RETRIES', 3))
+# Timeouts and (optional) hedging, tuned per endpoint from the observed latencies
+latency_budgets = latency.from_env()
+# Cache of all replies, refreshed ahead of expiry for hot entries (see cache.LookupCache)
+lookup_cache = cache.from_env()
+# Optional on-disk store of MarineRegions geometries, shared by all workers on the machine
+geom_store = geomstore.from_env()
+# Optional local table of external ID -> AphiaID, consulted before WoRMS
+id_crosswalk = crosswalk.from_env()
+
+ID_SOURCES = {'algaebase': 'Algaebase species ID',
+              'bold': 'Barcode of Life Database (BOLD) TaxID',
+              'dyntaxa': 'Dyntaxa ID',
+              'fishbase': 'FishBase species ID',
+              'iucn': 'IUCN Red List Identifier',
+              'lsid': 'Life Science Identifier',
+              'ncbi': 'NCBI Taxonomy ID (Genbank)',
+              'tsn': 'ITIS Taxonomic Serial Number',
+              'gisd': 'Global Invasive Species Database'}
+
+# ---- WoRMS/MarineRegions urls, shared by the lookups and the provenance output ----
+def distribution_url(aphia_id):
+    return f'http://www.marinespecies.org/rest/AphiaDistributionsByAphiaID/{aphia_id}'
+
+def taxamatch_url(taxa_name):
+    return f'https://www.marinespecies.org/rest/AphiaRecordsByMatchNames?scientificnames[]={taxa_name}&marine_only=true'
+
+def external_id_url(external_id, id_source):
+    return f'https://marinespecies.org/rest/AphiaRecordByExternalID/{external_id}?type={id_source}'
+
+def gazetteer_url(lat, lon):
+    return f'https://www.marineregions.org/rest/getGazetteerRecordsByLatLong.json/{lat}/{lon}/?offset=0'
+
+@tracing.traced()
 def derive_status(this_aphia_df):
     '''
     Provide some human readable results...
@@ -47,7 +92,40 @@ def derive_status(this_aphia_df):
     return derived_status 
 
 
-def check_aphia(lon, lat, id, source='worms'):
+@tracing.traced()
+def derive_status_records(records):
+    '''
+    Same as derive_status, for the list of dicts used by the pandas-free path of check_aphia.
+    '''
+    log.debug(f'Preparing results...') 
+    if records is None:
+        return {'Status': ['Unrecorded'],
+                'Within': ['None']}
+    return {'Status': [record['establishmentMeans'] for record in records],
+            'Within': [record['MRGID'] for record in records]}
+
+
+def establishment_means(value):
+    '''
+    WRIMS "Alien" is reported as "Introduced", no establishmentMeans at all as "Recorded".
+    '''
+    if value is None:
+        return 'Recorded'
+    if value == 'Alien':
+        return 'Introduced'
+    return value
+
+
+def get_sample_mrgids(lat, lon):
+    '''
+    The set of MRGIDs that intersect with the sample location.
+    '''
+    sample_mr_response = get_mrgid_from_latlon(lat, lon) or []
+    return set([d.get('MRGID') for d in sample_mr_response])
+
+
+@tracing.traced()
+def check_aphia(lon, lat, id, source='worms', details=True, buffer=None):
     '''
     Check if the aphia is invasive, native or unknown. Return MRGID's that are within <buffer> degrees 
     of the sample location.
@@ -58,6 +136,16 @@ def check_aphia(lon, lat, id, source='worms'):
     
     geom_df is a dataframe of MRGID geoms retrieved from MR. 
     geom_store is a dict of geom_df
+
+    With details=False no dataframe is built at all: the status is derived straight from the
+    WRIMS json and None is returned in place of the details dataframe. This is a lot cheaper
+    for single lookups once the requests are cached.
+
+    With a buffer [km] the geometries of the distribution are fetched from MarineRegions and
+    the proximity fields of get_proximity are added to the status_dict.
+
+    If any of the lookups had to be answered with an expired cached reply, the status_dict
+    gets 'Stale': True.
     '''
     
     log.debug(f'Received request for {id} for location {lon}/{lat} ')
@@ -65,12 +153,33 @@ def check_aphia(lon, lat, id, source='worms'):
     # Get Aphia status, geoms associated with the aphia and whether the sample location is 
     # inside those geoms or not. 
     # =============
-    if source == 'worms':
-        aphia_id = id
-        this_aphia_df = get_aphia_status(aphia_id)
-    else:
-        aphia_id = get_external_status(id, source)
-        this_aphia_df = get_aphia_status(aphia_id)
+    with lookup_cache.track() as lookups:
+        if source == 'worms':
+            aphia_id = id
+        else:
+            aphia_id = get_external_status(id, source)
+
+        if details:
+            status_dict, invasive_df = check_aphia_df(lon, lat, aphia_id)
+        else:
+            status_dict, invasive_df = check_aphia_records(lon, lat, aphia_id)
+
+        if buffer is not None and 'Error' not in status_dict:
+            log.debug(f'  -Checking distance to distribution...')
+            status_dict.update(get_proximity([lon], [lat], aphia_id, buffer)[0])
+
+    if lookups.stale:
+        # Some of the WRIMS/MarineRegions data is older than the cache period
+        status_dict['Stale'] = True
+    return status_dict, invasive_df
+
+
+def check_aphia_df(lon, lat, aphia_id):
+    '''
+    check_aphia for an AphiaID, with the WRIMS distribution handled as a dataframe. Also returns
+    the part of the distribution that intersects with the sample location.
+    '''
+    this_aphia_df = get_aphia_status(aphia_id)
 
     if this_aphia_df is None:
         status_dict = {'aphia_id': aphia_id,
@@ -80,14 +189,12 @@ def check_aphia(lon, lat, id, source='worms'):
      
     # Finds MRGIDs that intersect with the sample location 
     log.debug(f'  -Finding MarineRegions that intersect with sample...')
-    sample_mr_response = get_mrgid_from_latlon(lat,lon)
-    sample_mrgids = list(set([d.get('MRGID') for d in sample_mr_response]))
+    sample_mrgids = list(get_sample_mrgids(lat, lon))
 
     # Find intersecting MRGIDs that are also in the WRIMS response
     this_aphia_df = this_aphia_df[this_aphia_df['MRGID'].isin(sample_mrgids)]
     #-----------------------
 
-    # this_aphia_gdf['distance_to_distribution'] = this_aphia_gdf.distance(sample_point)
     this_aphia_df.establishmentMeans.replace('Alien','Introduced',inplace=True)
     this_aphia_df.establishmentMeans.fillna('Recorded',inplace=True)
     
@@ -102,7 +209,6 @@ def check_aphia(lon, lat, id, source='worms'):
     #   - Drop geom column since it can get very big 
     #   - drop non-useful or confusing columns
     # =============
-    # this_aphia_gdf = this_aphia_gdf[this_aphia_gdf['distance_to_distribution'] < buffer]
     invasive_df = this_aphia_df.drop(['decimalLongitude', 
                                     'decimalLatitude', 
                                     'higherGeography',
@@ -112,7 +218,145 @@ def check_aphia(lon, lat, id, source='worms'):
     log.debug(f'  -Done:')
     log.debug(status_dict)
     return status_dict, invasive_df
+
+
+def check_aphia_records(lon, lat, aphia_id):
+    '''
+    Pandas-free version of check_aphia for a single AphiaID/location. Gives the same
+    status_dict; the details dataframe is not built so None is returned in its place.
+    '''
+    records = get_aphia_distribution(aphia_id)
+    if records is None:
+        status_dict = {'aphia_id': aphia_id,
+                       'Error': 'No distribution found for this Aphia_ID'}
+        return status_dict, None
+
+    log.debug(f'  -Finding MarineRegions that intersect with sample...')
+    sample_mrgids = get_sample_mrgids(lat, lon)
+    matches = [{'MRGID': record['MRGID'],
+                'establishmentMeans': establishment_means(record.get('establishmentMeans'))}
+               for record in records if record['MRGID'] in sample_mrgids]
+
+    log.debug(f'  -Applying logic...')
+    status_dict = derive_status_records(matches)
+    log.debug(f'  -Done:')
+    log.debug(status_dict)
+    return status_dict, None
    
+# Fields of get_proximity
+PROXIMITY_FIELDS = ['sample location within <buffer> of aphia distribution',
+                    'buffer [km]',
+                    'distance [km] to nearest introduced location',
+                    'nearest introduced MRGID']
+
+@tracing.traced()
+def get_proximity(lons, lats, aphia_id, buffer):
+    '''
+    How close are the sample locations to the distribution of the aphia_id? For each lon/lat a dict
+    with the proximity fields of check_aphia:
+      - within <buffer> [km] of any region of the WRIMS distribution
+      - geodesic distance [km] to the nearest region where the aphia is introduced (None if there
+        are no introduced regions)
+      - the MRGIDs of the nearest introduced region/s
+
+    All sample locations are handled in one pass per engine, so pass every location of an
+    AphiaID in a run at once.
+    '''
+    records = get_aphia_distribution(aphia_id) or []
+    introduced = set([record['MRGID'] for record in records
+                      if establishment_means(record.get('establishmentMeans')) == 'Introduced'])
+    mrgids = set([record['MRGID'] for record in records])
+
+    if geom_store is None:
+        geoms = {mrgid: get_mrgid_geometry(mrgid) for mrgid in mrgids}
+        distribution = ProximityEngine(geoms)
+        introduced_regions = ProximityEngine({mrgid: geom for mrgid, geom in geoms.items() if mrgid in introduced})
+    else:
+        # Only the coarse geometries are read up front, full ones just for borderline samples
+        for mrgid in mrgids:
+            if mrgid not in geom_store:
+                get_mrgid_geometry(mrgid)
+        distribution = geom_store.engine(mrgids)
+        introduced_regions = geom_store.engine(mrgids & introduced)
+    within = distribution.within(lons, lats, buffer)
+    distance_km, nearest_mrgids = introduced_regions.nearest(lons, lats)
+
+    return [{'sample location within <buffer> of aphia distribution': bool(within[i]),
+             'buffer [km]': buffer,
+             'distance [km] to nearest introduced location': None if math.isnan(distance_km[i]) else float(distance_km[i]),
+             'nearest introduced MRGID': nearest_mrgids[i]}
+            for i in range(len(within))]
+
+
+def wkt_to_geometry(wkt):
+    '''
+    GeoSPARQL WKT literals can start with the CRS IRI: "<http://www.opengis.net/def/crs/OGC/1.3/CRS84> POLYGON (...)"
+    '''
+    return shapely.from_wkt(re.sub(r'^\s*<[^>]*>\s*', '', wkt))
+
+
+def get_mrgid_geometry(mrgid):
+    '''
+    Get the geometry (WGS84) of a MarineRegion. With a geometry store (GEOM_STORE) it is read from
+    the store, and fetched into the store the first time. Without one the parsed geometries of the
+    last regions used are kept in memory. Failed lookups (None) are never kept, so they are tried
+    again next time.
+    '''
+    if geom_store is None:
+        with _geometries_lock:
+            if mrgid in _geometries:
+                _geometries.move_to_end(mrgid)
+                return _geometries[mrgid]
+        geom = fetch_mrgid_geometry(mrgid)
+        if geom is not None:
+            with _geometries_lock:
+                _geometries[mrgid] = geom
+                while len(_geometries) > GEOMETRY_CACHE_SIZE:
+                    _geometries.popitem(last=False)
+        return geom
+    if mrgid in geom_store:
+        return geom_store.get(mrgid)
+    geom = fetch_mrgid_geometry(mrgid)
+    if geom is not None:
+        geom_store.put(mrgid, geom)
+    return geom
+
+
+@tracing.traced(cache='hit')
+def fetch_mrgid_geometry(mrgid):
+    '''
+    Fetch the geometry of a MarineRegion. MarineRegions returns the geometries as turtle with
+    GeoSPARQL WKT literals; if there are several they are merged into one.
+    https://marineregions.org/rest/getGazetteerGeometries.ttl/{mrgid}/
+
+    With a geometry store the parsed geometry is kept there, so the (multi-MB) turtle reply is
+    not kept in lookup_cache as well.
+    '''
+    mr_url = f'https://marineregions.org/rest/getGazetteerGeometries.ttl/{mrgid}/'
+    try:
+        req_return = requester(mr_url, cached=geom_store is None)
+        if req_return is None:
+            log.warning(f'No geometry for MRGID {mrgid} found...')
+            return None
+        graph = Graph()
+        graph.parse(data=req_return.text, format='turtle')
+        geoms = [wkt_to_geometry(str(wkt)) for wkt in graph.objects(None, GSP.asWKT)]
+        if len(geoms) == 0:
+            log.warning(f'No geometry for MRGID {mrgid} found...')
+            return None
+        return shapely.unary_union(geoms)
+    except Exception as err:
+        log.warning(f'Error retrieving geometry for MRGID {mrgid}')
+        log.warning(err)
+        return None
+
+# Parsed geometries of the last regions used, when there is no geometry store
+GEOMETRY_CACHE_SIZE = 256
+_geometries = collections.OrderedDict()
+_geometries_lock = threading.Lock()
+
+
+@tracing.traced(cache='hit')
 def get_external_status( external_id, id_source):
     '''
     Get the APHIA ID from an externalID. See
@@ -127,22 +371,16 @@ def get_external_status( external_id, id_source):
     ncbi: NCBI Taxonomy ID (Genbank)
     tsn: ITIS Taxonomic Serial Number
     gisd: Global Invasive Species Database
+
+    The local crosswalk (ID_CROSSWALK) is checked first.
     '''
-    id_sources = {'algaebase': 'Algaebase species ID',
-                    'bold': 'Barcode of Life Database (BOLD) TaxID',
-                    'dyntaxa': 'Dyntaxa ID',
-                    'fishbase': 'FishBase species ID',
-                    'iucn': 'IUCN Red List Identifier',
-                    'lsid': 'Life Science Identifier',
-                    'ncbi': 'NCBI Taxonomy ID (Genbank)',
-                    'tsn': 'ITIS Taxonomic Serial Number',
-                    'gisd': 'Global Invasive Species Database'}
-
-    if id_source not in id_sources:
+    if id_source not in ID_SOURCES:
         log.warning(f'Unknown external source: {id_source}.')
         return None 
+    if id_crosswalk is not None and (external_id, id_source) in id_crosswalk:
+        return id_crosswalk.get(external_id, id_source)
     try:
-        aphia_url = f'https://marinespecies.org/rest/AphiaRecordByExternalID/{external_id}?type={id_source}'
+        aphia_url = external_id_url(external_id, id_source)
         aphia_return =  requester(aphia_url)
         if aphia_return is not None:
             aphia_id = aphia_return.json()['AphiaID']
@@ -154,13 +392,50 @@ def get_external_status( external_id, id_source):
         log.warning(err)
         return None 
 
+def resolve_external_ids(pairs, workers=8):
+    '''
+    Bulk version of get_external_status. Takes a list of (external_id, id_source) pairs and returns
+    {(external_id, id_source): aphia_id or None}.
+
+    Pairs are looked up in the local crosswalk (ID_CROSSWALK) first; only the misses are requested
+    from WoRMS, concurrently, and what they resolve to is added to the crosswalk and saved to
+    ID_CROSSWALK, so the next run doesn't ask again.
+    '''
+    pairs = list(dict.fromkeys(pairs))
+    resolved = {}
+    misses = []
+    for external_id, id_source in pairs:
+        if id_source not in ID_SOURCES:
+            log.warning(f'Unknown external source: {id_source}.')
+            resolved[(external_id, id_source)] = None
+        elif id_crosswalk is not None and (external_id, id_source) in id_crosswalk:
+            resolved[(external_id, id_source)] = id_crosswalk.get(external_id, id_source)
+        else:
+            misses.append((external_id, id_source))
+    log.info(f'Resolving external IDs: {len(resolved)} local, {len(misses)} from WoRMS')
+
+    added = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Each lookup runs in a copy of our context, so its spans are part of the caller's trace
+        futures = [executor.submit(contextvars.copy_context().run, get_external_status, *pair) for pair in misses]
+        aphia_ids = (future.result() for future in futures)
+        for (external_id, id_source), aphia_id in zip(misses, aphia_ids):
+            resolved[(external_id, id_source)] = aphia_id
+            if aphia_id is not None and id_crosswalk is not None:
+                id_crosswalk.add(external_id, id_source, aphia_id)
+                added += 1
+    if added:
+        id_crosswalk.save()
+    return resolved
+
+@tracing.traced(cache='hit')
 def get_aphia_status(aphia_id):
     '''
     Get the MRGIDs and invasive status for the aphia_id specified. Return dataframe with MRGID's of 
     known distribution and the the native/alien status of the MRGID/APHIA pair.
     Good test values are aphiaID = 107451 (chinese mitten crab, invasive)
     '''
-    wrms_distribution = f'http://www.marinespecies.org/rest/AphiaDistributionsByAphiaID/{aphia_id}'
+    wrms_distribution = distribution_url(aphia_id)
     try:
         req_return = requester(wrms_distribution)
         if req_return is not None:
@@ -187,20 +462,113 @@ def get_aphia_status(aphia_id):
         log.warning(err)
         return None
 
-@functools.cache
-def requester(url):
+@tracing.traced(cache='hit')
+def get_aphia_distribution(aphia_id):
     '''
-    Do a safe request and return the result.
+    Same as get_aphia_status, but returns the valid, de-duplicated WRIMS distribution records as a
+    list of dicts (with an int MRGID added) instead of a dataframe.
+    '''
+    wrms_distribution = distribution_url(aphia_id)
+    try:
+        req_return = requester(wrms_distribution)
+        if req_return is not None:
+            wrms_dist = req_return.json()
+        else:
+            return None
+
+        if len(wrms_dist) == 0 :
+            log.warning(f'No distribution for Aphia {aphia_id}')
+            return None
+
+        seen = set()
+        records = []
+        for record in wrms_dist:
+            key = json.dumps(record, sort_keys=True)
+            if key in seen:
+                continue
+            seen.add(key)
+            if record.get('recordStatus') != 'valid':
+                continue
+            record = dict(record)
+            record['MRGID'] = int(record['locationID'].rsplit('/', 1)[1])
+            records.append(record)
+
+        if len(records) == 0:
+            log.warning(f'No valid distribution records for Aphia {aphia_id}')
+            return None
+        return records
+    except Exception as err:
+        log.warning(f'Error retrieving distribution for aphia {aphia_id}')
+        log.warning(err)
+        return None
+
+def fetch(url):
+    '''
+    Do the actual request, rate limited and retried when throttled. Returns a cache.CachedReply
+    for replies that are worth caching, raises cache.UpstreamError otherwise.
+
+    The request times out, and may be hedged, as set by latency_budgets for its endpoint. With a
+    run deadline (see cache.LookupCache.set_deadline) the rate limiter waits, retries and timeouts
+    are kept within the time left; a lookup that can't be made in time raises cache.Deferred.
     '''
     log.debug('    -Doing URL request: {0}'.format(url))
-    reply = requests.get(url)
+    # Only runs when the url isn't cached (or is being refreshed): mark the calling span as a cache miss
+    tracing.annotate(cache='miss')
+    started = time.perf_counter()
+    with tracing.span('http', url=url) as attrs:
+        for attempt in range(MAX_RETRIES + 1):
+            remaining = lookup_cache.remaining()
+            if remaining == 0 or not limiter.acquire(url, timeout=remaining):
+                raise cache.Deferred(f'Deferred {url}: not enough time left before the run deadline')
+            try:
+                reply, hedged = latency_budgets.get(url, limiter, max_timeout=lookup_cache.remaining())
+            except requests.RequestException as error:
+                raise cache.UpstreamError('Request to {0} failed: {1}'.format(url, error))
+            if hedged:
+                attrs['hedged'] = True
+            if reply.status_code == 429:
+                log.warning('Going too fast! Attempt {0} of {1} for {2}'.format(attempt + 1, MAX_RETRIES + 1, url))
+                limiter.backoff(url, reply.headers.get('Retry-After'))
+                continue
+            if reply.status_code >= 500:
+                # Retried, but a failing upstream is no reason to raise the rate
+                log.warning('Server error {0}, attempt {1} of {2} for {3}'.format(reply.status_code, attempt + 1, MAX_RETRIES + 1, url))
+                continue
+            if reply.status_code < 400:
+                limiter.success(url)
+            break
+        attrs['status'] = reply.status_code
+        attrs['attempts'] = attempt + 1
+    log.debug('    -Request took {0:.3f}s ({1}): {2}'.format(time.perf_counter() - started, reply.status_code, url))
+
+    if reply.status_code not in cache.CACHEABLE_STATUS:
+        raise cache.UpstreamError('{0} for {1}: {2}'.format(reply, url, reply.text))
+    return cache.CachedReply.from_response(reply)
+
+def requester(url, cached=True):
+    '''
+    Do a safe request and return the result.
+
+    Replies come from lookup_cache when possible. If the cached reply has expired and WoRMS/
+    MarineRegions can't be reached, or a hot entry is being revalidated, the old reply is
+    returned with reply.stale set. With cached=False the request is always made and the reply
+    isn't kept, for callers that keep what they need from it themselves.
+    '''
+    try:
+        if cached:
+            reply = lookup_cache.get(url, fetch)
+        else:
+            try:
+                reply = fetch(url)
+            except cache.Deferred:
+                lookup_cache.defer(url)
+    except cache.UpstreamError as error:
+        # Something not right with the request...
+        log.warning(error)
+        return None
+
     if reply.status_code == 200:
-        try:
-            r = reply
-        except Exception as error:
-            log.error(error)
-            r = None
-        return r
+        return reply
     elif reply.status_code == 204:
         log.warning('No Content for {0}...'.format(url))
         return None
@@ -210,32 +578,41 @@ def requester(url):
         log.warning(reply.text)
         return None
 
+@tracing.traced()
 def get_aphia_from_lineage(tax_string, sep = ';'):
     '''
     Given a taxon lineage string (Eukaryota;Chordata;Ascidiacea;Enterogona;Ascidiidae;Ascidiella;Ascidiella scabra)
     get the aphia_id for the lowest level.
+
+    If a level is deferred (run deadline passed, see cache.LookupCache) the walk stops there and
+    None is returned, rather than matching a higher level.
     '''
     tax_lineage = tax_string.split(sep)
     log.debug('Checking taxon: {0}'.format(tax_lineage))
     req_return = None
-    while req_return is None:
-        try:
-            req_return = get_aphia_from_taxname(tax_lineage[-1])
-            tax_lineage.pop(-1)
-        except IndexError:
-            log.warning('Reached end of taxon lineage without success...')
-            break
+    with lookup_cache.track() as lookups:
+        while req_return is None:
+            try:
+                req_return = get_aphia_from_taxname(tax_lineage[-1])
+                tax_lineage.pop(-1)
+            except IndexError:
+                log.warning('Reached end of taxon lineage without success...')
+                break
+            if lookups.deferred:
+                log.warning('Lineage lookup deferred: {0}'.format(tax_string))
+                break
     return req_return
 
+@tracing.traced(cache='hit')
 def get_aphia_from_taxname(taxa_name):
     '''
     Given a taxon name string, get the aphia_id/s that are associated with it. 
 
     https://www.marinespecies.org/rest/AphiaRecordsByMatchNames?scientificnames[]=<some name>&marine_only=true
     '''
-    taxamatch_url = f'https://www.marinespecies.org/rest/AphiaRecordsByMatchNames?scientificnames[]={taxa_name}&marine_only=true'
+    match_url = taxamatch_url(taxa_name)
     try:
-        req_return = requester(taxamatch_url)
+        req_return = requester(match_url)
 
         if (req_return is None):
             log.warning(f'No AphiaID for taxname {taxa_name} found...')
@@ -252,17 +629,18 @@ def get_aphia_from_taxname(taxa_name):
             log.warning(req_return)
             return None
     except Exception as err:
-        log.warning(f'Error retrieving aphia_id for sci-name: {taxamatch_url}')
+        log.warning(f'Error retrieving aphia_id for sci-name: {match_url}')
         log.warning(err)
         return None
 
 
+@tracing.traced(cache='hit')
 def get_mrgid_from_latlon(lat,lon):
     '''
     Given a the location of a sample, find the Marineregions that intersect with it. 
     https://www.marineregions.org/rest/getGazetteerRecordsByLatLong.json/{lat}{lon}/?offset=0
     '''
-    mr_url = f'https://www.marineregions.org/rest/getGazetteerRecordsByLatLong.json/{lat}/{lon}/?offset=0'
+    mr_url = gazetteer_url(lat, lon)
     try:
         req_return = requester(mr_url)
         if (req_return is None):
@@ -0,0 +1,236 @@
+import os
+import math
+import time
+import logging
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+import requests
+
+from invasive_checker.ratelimit import host_of
+
+log = logging.getLogger('latency')
+
+'''
+Per-endpoint latency budgets and hedged requests.
+
+Every request time is recorded in a histogram of its endpoint (host + REST method, e.g.
+marineregions.org/rest/getGazetteerRecordsByLatLong.json). Once an endpoint has enough
+samples the histogram sets its thresholds:
+
+  - timeout: TIMEOUT_FACTOR x p99. This is the requests timeout, which applies per socket
+    operation (connecting, and each wait for data), not to the request as a whole: it stops a
+    call that hangs, not one that is slow but steadily sending.
+  - hedge delay: p95. A request still without a reply after that gets a duplicate, and the
+    first successful reply (not a 429 or 5xx) wins. The duplicate needs a free token of the
+    rate limiter, so hedging never adds load on a host that is already at its limit.
+
+Until then requests use the default timeout and are not hedged.
+
+Each request of a hedge runs on a thread of its own, started right away, so the hedge delay is
+counted from when the request is actually sent. A running request can't be cancelled: the
+losing request of a hedge runs on in the background until it gets its reply or times out, and
+its rate limiter token stays spent.
+'''
+
+# Histogram bucket bounds [s]: 1ms to ~5min, 20% apart
+BOUNDS = [0.001 * 1.2 ** i for i in range(70)]
+TIMEOUT_FACTOR = 3.0
+
+
+def endpoint(url):
+    '''
+    Host (as the rate limiter names it, see ratelimit.host_of) and REST method of url, without
+    the lookup arguments.
+    '''
+    return host_of(url) + '/'.join(urlparse(url).path.split('/')[:3])
+
+
+def successful(response):
+    '''
+    A reply that answers the request, as opposed to a 429 or a server error worth retrying.
+    '''
+    return response.status_code != 429 and response.status_code < 500
+
+
+class LatencyHistogram:
+    '''
+    Counts of request times [s] in log-spaced buckets, so quantiles can be taken without
+    keeping every sample.
+    '''
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        if seconds <= BOUNDS[0]:
+            index = 0
+        else:
+            index = min(len(BOUNDS), math.ceil(math.log(seconds / BOUNDS[0], 1.2)))
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+
+    def quantile(self, q):
+        '''
+        Upper bound [s] of the bucket holding the q quantile, None without samples.
+        '''
+        with self._lock:
+            if self.count == 0:
+                return None
+            rank = q * self.count
+            cumulative = 0
+            for index, count in enumerate(self.counts):
+                cumulative += count
+                if cumulative >= rank and count:
+                    return BOUNDS[min(index, len(BOUNDS) - 1)]
+        return BOUNDS[-1]
+
+
+class LatencyBudgets:
+    '''
+    Latency histograms per endpoint, the timeouts and hedge delays derived from them, and the
+    (optionally hedged) GET that uses them.
+    '''
+
+    def __init__(self, timeout=60.0, min_timeout=5.0, hedge=False, hedge_quantile=0.95,
+                 timeout_quantile=0.99, min_samples=20):
+        self.default_timeout = float(timeout)
+        self.min_timeout = min(float(min_timeout), self.default_timeout)
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.timeout_quantile = timeout_quantile
+        self.min_samples = int(min_samples)
+        self.hedges = 0
+        self.hedges_won = 0
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, url):
+        key = endpoint(url)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = LatencyHistogram()
+            return self._histograms[key]
+
+    def record(self, url, seconds):
+        self.histogram(url).record(seconds)
+
+    def _quantile(self, url, q):
+        histogram = self.histogram(url)
+        if histogram.count < self.min_samples:
+            return None
+        return histogram.quantile(q)
+
+    def timeout(self, url):
+        '''
+        Timeout [s] of each socket operation of a request to url (see requests' timeout).
+        '''
+        p99 = self._quantile(url, self.timeout_quantile)
+        if p99 is None:
+            return self.default_timeout
+        return min(self.default_timeout, max(self.min_timeout, TIMEOUT_FACTOR * p99))
+
+    def hedge_delay(self, url):
+        '''
+        Seconds to wait for a reply before sending a duplicate request, None when not hedging.
+        '''
+        if not self.hedge:
+            return None
+        return self._quantile(url, self.hedge_quantile)
+
+    def snapshot(self):
+        '''
+        {endpoint: {'count', 'p50', 'p95', 'p99'}} of all endpoints seen so far.
+        '''
+        with self._lock:
+            histograms = dict(self._histograms)
+        return {key: {'count': histogram.count,
+                      'p50': histogram.quantile(0.5),
+                      'p95': histogram.quantile(0.95),
+                      'p99': histogram.quantile(0.99)}
+                for key, histogram in histograms.items()}
+
+    def _timed_get(self, url, timeout, get):
+        started = time.perf_counter()
+        try:
+            return get(url, timeout=timeout)
+        finally:
+            # Failed and timed out requests count too: they say how slow the endpoint is
+            self.record(url, time.perf_counter() - started)
+
+    def _start(self, url, timeout, get):
+        '''
+        _timed_get on a thread of its own, as a Future. A shared pool would let requests queue
+        for a worker, and the time in the queue would count against the hedge delay.
+        '''
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        def run():
+            try:
+                future.set_result(self._timed_get(url, timeout, get))
+            except BaseException as error:
+                future.set_exception(error)
+        threading.Thread(target=run, name='hedge', daemon=True).start()
+        return future
+
+    def get(self, url, limiter, get=None, max_timeout=None):
+        '''
+        GET url with the timeout of its endpoint, hedged if it is slow. The caller has already
+        taken a rate limiter token for the first request. Returns (response, hedged); raises
+        requests.RequestException (also requests.Timeout) as requests.get does.
+
+        max_timeout [s] caps the timeout of the endpoint, e.g. to the time left before a deadline.
+
+        When hedged, the first successful reply wins. If neither reply is successful the first
+        one is returned, so the caller handles its 429/5xx; an exception is only raised when
+        both requests failed.
+        '''
+        get = get or requests.get
+        timeout = self.timeout(url)
+        if max_timeout is not None:
+            timeout = max(0.1, min(timeout, max_timeout))
+        delay = self.hedge_delay(url)
+        if delay is None:
+            return self._timed_get(url, timeout, get), False
+
+        first = self._start(url, timeout, get)
+        done, _ = wait([first], timeout=delay)
+        if done or not limiter.try_acquire(url):
+            return first.result(), False
+
+        log.debug(f'    -No reply after {delay:.2f}s, hedging {url}')
+        with self._lock:
+            self.hedges += 1
+        second = self._start(url, timeout, get)
+        pending = {first, second}
+        failed = None
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                elif not successful(future.result()):
+                    failed = failed or future.result()
+                else:
+                    # The loser runs on in the background, see the module docstring
+                    if future is second:
+                        with self._lock:
+                            self.hedges_won += 1
+                    return future.result(), True
+        if failed is not None:
+            return failed, True
+        raise error
+
+
+def from_env():
+    '''
+    LatencyBudgets with the REQUEST_TIMEOUT [s] and HEDGE_REQUESTS (true/false) env variables.
+    '''
+    return LatencyBudgets(timeout=float(os.getenv('REQUEST_TIMEOUT', 60)),
+                          hedge=os.getenv('HEDGE_REQUESTS', 'false').lower() in ('1', 'true', 'yes'))
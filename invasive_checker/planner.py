@@ -0,0 +1,166 @@
+import logging
+
+from invasive_checker import invasive_checker
+from invasive_checker.ratelimit import host_of
+
+log = logging.getLogger('planner')
+
+'''
+Dry-run planner: works out which WoRMS/MarineRegions lookups a run will need, and how many of
+them are already cached, without any network calls. Only the lookup cache (memory and
+CACHE_DIR) and the crosswalk are read.
+
+A lineage is resolved level by level from the lowest one (see get_aphia_from_lineage), so the
+walk is replayed on the cached replies: cached "no match" levels are skipped until a cached
+match (the AphiaID is then known) or an uncached level. From an uncached level on, the outcome
+is unknown; that lineage costs at least one and at most all of its remaining levels, and its
+AphiaID (and so its distribution) is unknown too. That is why calls are given as a range.
+'''
+
+
+class LookupPlan:
+    '''
+    Lookup plan for a run. Feed it the rows as do_work would process them, then print report():
+
+        plan = LookupPlan()
+        for classification, lon, lat, negative_control in rows:
+            plan.add_row(classification, lon, lat, negative_control)
+        print(plan.report())
+    '''
+
+    def __init__(self, lookup_cache=None, limiter=None, id_crosswalk=None):
+        self.lookup_cache = lookup_cache if lookup_cache is not None else invasive_checker.lookup_cache
+        self.limiter = limiter if limiter is not None else invasive_checker.limiter
+        self.id_crosswalk = id_crosswalk if id_crosswalk is not None else invasive_checker.id_crosswalk
+        self.rows = 0
+        self.lineages = {}
+        self.sites = set()
+        self.external_ids = set()
+
+    # ---- cache ----
+    def cached(self, url):
+        '''
+        The cached reply for url if it is still fresh (so won't be fetched again), else None.
+        '''
+        reply = self.lookup_cache.peek(url)
+        if reply is None or self.lookup_cache.clock() - reply.fetched_at >= self.lookup_cache.ttl:
+            return None
+        return reply
+
+    def walk_lineage(self, classification, sep=';'):
+        '''
+        Replay get_aphia_from_lineage on the cache. Returns (aphia_id or None, levels that
+        may need a request, in walk order). aphia_id is 'No Match' if every level is
+        cached without a match.
+        '''
+        levels = classification.split(sep)
+        for position in range(len(levels) - 1, -1, -1):
+            reply = self.cached(invasive_checker.taxamatch_url(levels[position]))
+            if reply is None:
+                return None, levels[position::-1]
+            if reply.status_code == 200:
+                try:
+                    return reply.json()[0][0]['AphiaID'], []
+                except (ValueError, LookupError, TypeError):
+                    pass
+        return 'No Match', []
+
+    # ---- input ----
+    def add_row(self, classification, lon, lat, negative_control=False):
+        self.rows += 1
+        if isinstance(classification, str) and classification not in self.lineages:
+            self.lineages[classification] = self.walk_lineage(classification)
+        if not negative_control:
+            self.sites.add((lat, lon))
+
+    def add_external_ids(self, pairs):
+        '''
+        (external_id, id_source) pairs that will be resolved, as with resolve_external_ids.
+        '''
+        self.external_ids.update((external_id, id_source) for external_id, id_source in pairs
+                                 if id_source in invasive_checker.ID_SOURCES)
+
+    # ---- plan ----
+    def uncached(self, urls):
+        return [url for url in urls if self.cached(url) is None]
+
+    def summary(self):
+        '''
+        {lookup: {'unique', 'cached', 'min_calls', 'max_calls', 'host'}}, the lookups being
+        lineages, lineage levels, AphiaIDs (distributions), external IDs and sites.
+        '''
+        levels = set()
+        first_levels = set()
+        open_levels = set()
+        aphia_ids = set()
+        for classification, (aphia_id, uncached) in self.lineages.items():
+            levels.update(classification.split(';'))
+            if aphia_id is None:
+                first_levels.add(uncached[0])
+                open_levels.update(uncached)
+            elif aphia_id != 'No Match':
+                aphia_ids.add(aphia_id)
+        unresolved = sum(1 for aphia_id, _ in self.lineages.values() if aphia_id is None)
+        level_urls = [invasive_checker.taxamatch_url(level) for level in levels]
+        open_urls = self.uncached(invasive_checker.taxamatch_url(level) for level in open_levels)
+
+        def lookup(unique, cached, min_calls, max_calls, url):
+            return {'unique': unique, 'cached': cached, 'min_calls': min_calls, 'max_calls': max_calls,
+                    'host': host_of(url)}
+
+        distributions = self.uncached(invasive_checker.distribution_url(aphia_id) for aphia_id in aphia_ids)
+        external_ids = [(external_id, id_source) for external_id, id_source in self.external_ids
+                        if self.id_crosswalk is None or (external_id, id_source) not in self.id_crosswalk]
+        external = self.uncached(invasive_checker.external_id_url(external_id, id_source)
+                                 for external_id, id_source in external_ids)
+        sites = self.uncached(invasive_checker.gazetteer_url(lat, lon) for lat, lon in self.sites)
+
+        return {'lineages': lookup(len(self.lineages), len(self.lineages) - unresolved, 0, 0,
+                                   invasive_checker.taxamatch_url('')),
+                'lineage levels': lookup(len(levels), len(levels) - len(self.uncached(level_urls)),
+                                         len(first_levels), len(open_urls), invasive_checker.taxamatch_url('')),
+                # Every unresolved lineage can add an AphiaID whose distribution isn't cached
+                'AphiaIDs': lookup(len(aphia_ids), len(aphia_ids) - len(distributions),
+                                   len(distributions), len(distributions) + unresolved,
+                                   invasive_checker.distribution_url('')),
+                'external IDs': lookup(len(self.external_ids), len(self.external_ids) - len(external),
+                                       len(external), len(external), invasive_checker.external_id_url('', '')),
+                # The site of a row is only looked up when its AphiaID has a distribution
+                'sites': lookup(len(self.sites), len(self.sites) - len(sites), 0, len(sites),
+                                invasive_checker.gazetteer_url(0, 0))}
+
+    def projected_seconds(self, plan, calls='max_calls'):
+        '''
+        Time [s] to make the calls of the plan one after the other, at the current rate limit of each host.
+        '''
+        per_host = {}
+        for lookup in plan.values():
+            per_host[lookup['host']] = per_host.get(lookup['host'], 0) + lookup[calls]
+        return sum(count / self.limiter.current_rate('https://' + host) for host, count in per_host.items() if count)
+
+    def report(self):
+        plan = self.summary()
+        lines = ['Lookup plan for {0} rows (no requests made)'.format(self.rows),
+                 '{0:<16}{1:>10}{2:>10}{3:>18}'.format('', 'unique', 'cached', 'upstream calls')]
+        for name, lookup in plan.items():
+            calls = str(lookup['min_calls'])
+            if lookup['max_calls'] != lookup['min_calls']:
+                calls = '{0} - {1}'.format(lookup['min_calls'], lookup['max_calls'])
+            lines.append('{0:<16}{1:>10}{2:>10}{3:>18}'.format(name, lookup['unique'], lookup['cached'], calls))
+        lines.append('Upstream calls: {0} - {1}'.format(sum(lookup['min_calls'] for lookup in plan.values()),
+                                                        sum(lookup['max_calls'] for lookup in plan.values())))
+        for host in sorted({lookup['host'] for lookup in plan.values() if lookup['max_calls']}):
+            lines.append('  {0}: {1:.2f} req/s'.format(host, self.limiter.current_rate('https://' + host)))
+        lines.append('Projected wall time at the current rate limits: {0} - {1}'.format(
+            format_seconds(self.projected_seconds(plan, 'min_calls')), format_seconds(self.projected_seconds(plan))))
+        return '\n'.join(lines)
+
+
+def format_seconds(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '{0}h{1:02d}m{2:02d}s'.format(hours, minutes, seconds)
+    if minutes:
+        return '{0}m{1:02d}s'.format(minutes, seconds)
+    return '{0}s'.format(seconds)
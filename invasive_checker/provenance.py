@@ -0,0 +1,234 @@
+import os
+import re
+import gzip
+import math
+import uuid
+import logging
+import datetime
+import threading
+from urllib.parse import quote
+
+from rdflib import URIRef, Literal, Namespace
+from rdflib.namespace import RDF, RDFS, XSD, PROV
+
+from invasive_checker import invasive_checker
+
+log = logging.getLogger('provenance')
+
+'''
+Streaming RDF provenance of a run, written as N-Triples (or Turtle) while the rows are processed.
+
+Nothing is collected in an rdflib Graph: every enriched row is turned into a handful of triples
+that are written straight to the file, so memory use doesn't grow with the run. rdflib is only
+used for its terms. For each row with a count the output links
+
+    occurrence (OTU x sample) -> OTU -> AphiaID -> MRGID -> establishmentMeans
+
+with the WoRMS/MarineRegions urls each statement came from, and the run to the md5s of its
+input files:
+
+    <run>  a prov:Activity ; prov:used <input file> .
+    <input file>  ic:md5 "..." .
+    <occurrence>  a dwc:Occurrence ; ic:otu <otu> ; dwc:taxonID <urn:lsid:marinespecies.org:taxname:107451> ;
+                  prov:wasGeneratedBy <run> .
+    <assessment>  ic:occurrence <occurrence> ; dwc:taxonID <...> ;
+                  dwc:locationID <http://marineregions.org/mrgid/21912> ; dwc:establishmentMeans "Introduced" ;
+                  prov:wasDerivedFrom <distribution url>, <gazetteer url> .
+
+The same OTU/AphiaID triples are written again for every sample they occur in; triple stores
+keep one copy, and not de-duplicating them here is what keeps memory flat.
+'''
+
+DWC = Namespace('http://rs.tdwg.org/dwc/terms/')
+IC = Namespace('urn:invasive-checker:vocab:')
+BASE = 'urn:invasive-checker:'
+
+PREFIXES = {'rdf': RDF, 'rdfs': RDFS, 'xsd': XSD, 'prov': PROV, 'dwc': DWC, 'ic': IC}
+
+# Statuses that stand for "no (known) WRIMS status" rather than an establishmentMeans
+PLACEHOLDER_STATUSES = ('Pending', 'Unrecorded')
+
+# Local names that can be written as prefix:name in Turtle without escaping
+PNAME_LOCAL = re.compile(r'^[A-Za-z_][A-Za-z0-9_-]*$')
+
+
+def aphia_iri(aphia_id):
+    return URIRef(f'urn:lsid:marinespecies.org:taxname:{aphia_id}')
+
+
+def mrgid_iri(mrgid):
+    return URIRef(f'http://marineregions.org/mrgid/{mrgid}')
+
+
+def _value(value):
+    '''
+    None for the empty/missing values pandas leaves in a row.
+    '''
+    if value is None or value == '' or value == 'No Match':
+        return None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def _literal(literal):
+    '''
+    N-Triples form of a literal, which is valid Turtle too (Literal.n3 uses """long strings"""
+    for values with line breaks, which N-Triples doesn't have).
+    '''
+    value = (str(literal).replace('\\', '\\\\').replace('"', '\\"')
+             .replace('\n', '\\n').replace('\r', '\\r'))
+    if literal.language:
+        return f'"{value}"@{literal.language}'
+    if literal.datatype:
+        return f'"{value}"^^<{literal.datatype}>'
+    return f'"{value}"'
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class TripleWriter:
+    '''
+    Writes the provenance triples of a run to path, one line per triple. The format follows the
+    extension: .ttl is Turtle (with prefixes), anything else N-Triples; a .gz suffix compresses.
+
+        with TripleWriter('provenance.nt', inputs={input_file: md5, meta_file: md5}) as writer:
+            for row in rows:
+                writer.write_row(row)
+    '''
+
+    def __init__(self, path, inputs=None, base=BASE):
+        self.path = path
+        self.base = base
+        name = path[:-len('.gz')] if path.endswith('.gz') else path
+        self.turtle = name.endswith('.ttl')
+        opener = gzip.open if path.endswith('.gz') else open
+        self._file = opener(path, 'wt', encoding='utf8')
+        self._lock = threading.Lock()
+        self.triples = 0
+        self.run = URIRef(f'{base}run/{uuid.uuid4()}')
+
+        if self.turtle:
+            for prefix, namespace in PREFIXES.items():
+                self._file.write(f'@prefix {prefix}: <{namespace}> .\n')
+            self._file.write('\n')
+        self.start_run(inputs or {})
+        log.info(f'Writing provenance triples to {path}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _term(self, term):
+        if isinstance(term, Literal):
+            return _literal(term)
+        if self.turtle:
+            for prefix, namespace in PREFIXES.items():
+                local = term[len(str(namespace)):]
+                if term.startswith(str(namespace)) and PNAME_LOCAL.match(local):
+                    return f'{prefix}:{local}'
+        return term.n3()
+
+    def triple(self, s, p, o):
+        line = f'{self._term(s)} {self._term(p)} {self._term(o)} .\n'
+        with self._lock:
+            self._file.write(line)
+            self.triples += 1
+
+    def iri(self, *parts):
+        return URIRef(self.base + '/'.join(quote(str(part), safe='') for part in parts))
+
+    def start_run(self, inputs):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.triple(self.run, RDF.type, PROV.Activity)
+        self.triple(self.run, PROV.startedAtTime, Literal(now))
+        for path, md5 in inputs.items():
+            entity = URIRef('file://' + quote(os.path.abspath(path)))
+            self.triple(self.run, PROV.used, entity)
+            self.triple(entity, RDF.type, PROV.Entity)
+            self.triple(entity, RDFS.label, Literal(os.path.basename(path)))
+            self.triple(entity, IC.md5, Literal(md5))
+
+    def write_row(self, row):
+        '''
+        Triples of one enriched row (see process_input_row in app/main.py). Rows without a count
+        are not occurrences and are skipped.
+        '''
+        count = _value(row.get('Count'))
+        otu = _value(row.get('OTU'))
+        accession = _value(row.get('AccessionID'))
+        if otu is None or accession is None or count is None or float(count) <= 0:
+            return
+
+        occurrence = self.iri('occurrence', otu, accession)
+        otu_node = self.iri('otu', otu)
+        self.triple(occurrence, RDF.type, DWC.Occurrence)
+        self.triple(occurrence, PROV.wasGeneratedBy, self.run)
+        self.triple(occurrence, IC.otu, otu_node)
+        self.triple(occurrence, DWC.materialSampleID, Literal(str(accession)))
+        self.triple(occurrence, DWC.organismQuantity, Literal(count.item() if hasattr(count, 'item') else count))
+        lookup_status = _value(row.get('Lookup Status'))
+        if lookup_status is not None:
+            self.triple(occurrence, IC.lookupStatus, Literal(str(lookup_status)))
+        lat = _value(row.get('latitude'))
+        lon = _value(row.get('longitude'))
+        if lat is not None and lon is not None:
+            self.triple(occurrence, DWC.decimalLatitude, Literal(float(lat)))
+            self.triple(occurrence, DWC.decimalLongitude, Literal(float(lon)))
+
+        self.triple(otu_node, RDFS.label, Literal(str(otu)))
+        classification = _value(row.get('classification'))
+        if classification is not None:
+            self.triple(otu_node, DWC.higherClassification, Literal(str(classification)))
+
+        aphia_id = _int(_value(row.get('Aphia_ID')))
+        if aphia_id is None:
+            return
+        taxon = aphia_iri(aphia_id)
+        self.triple(otu_node, IC.aphia, taxon)
+        self.triple(occurrence, DWC.taxonID, taxon)
+        sci_name = _value(row.get('Worms SciName'))
+        if sci_name is not None:
+            self.triple(taxon, DWC.scientificName, Literal(str(sci_name)))
+        rank = _value(row.get('Worms SciName Rank'))
+        if rank is not None:
+            self.triple(taxon, DWC.taxonRank, Literal(str(rank)))
+
+        statuses = row.get('WRIMS Status at Sample Location')
+        mrgids = row.get('MarineRegions with known occurrence at Sample Location')
+        if not isinstance(statuses, list) or not isinstance(mrgids, list):
+            return
+        sources = [URIRef(invasive_checker.distribution_url(aphia_id))]
+        if lat is not None and lon is not None:
+            sources.append(URIRef(invasive_checker.gazetteer_url(lat, lon)))
+        for status, mrgid in zip(statuses, mrgids):
+            # Only real assessments: a region with a WRIMS status, not the placeholders
+            mrgid = _int(mrgid)
+            if mrgid is None or _value(status) is None or status in PLACEHOLDER_STATUSES:
+                continue
+            assessment = self.iri('occurrence', otu, accession, mrgid)
+            self.triple(assessment, RDF.type, IC.StatusAssessment)
+            self.triple(assessment, IC.occurrence, occurrence)
+            self.triple(assessment, DWC.taxonID, taxon)
+            self.triple(assessment, DWC.establishmentMeans, Literal(str(status)))
+            self.triple(assessment, DWC.locationID, mrgid_iri(mrgid))
+            self.triple(assessment, PROV.wasGeneratedBy, self.run)
+            for source in sources:
+                self.triple(assessment, PROV.wasDerivedFrom, source)
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.triple(self.run, PROV.endedAtTime, Literal(now))
+        with self._lock:
+            self._file.close()
+        log.info(f'Wrote {self.triples} provenance triples to {self.path}')
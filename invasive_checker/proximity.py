@@ -0,0 +1,172 @@
+import logging
+
+import numpy as np
+import pyproj
+import shapely
+
+log = logging.getLogger('proximity')
+
+GEOD = pyproj.Geod(ellps='WGS84')
+
+# Regions whose distance is within this of the nearest one are all reported as nearest, so a
+# sample inside several overlapping regions gets all of their MRGIDs.
+TIE_KM = 1e-6
+
+# Upper bound of the length [km] of a one degree step in any direction on the WGS84 ellipsoid
+KM_PER_DEG = 112.0
+# Lower bound of the length [km] of one degree of latitude, and of one degree of longitude on the
+# equator (one degree of longitude at latitude lat is at least this times cos(lat))
+MIN_KM_PER_DEG = 110.5
+
+
+def geodesic_km(points, geoms):
+    '''
+    Geodesic distance [km] from each point to the nearest point of the geometry at the same position.
+
+    The nearest point is found in a local frame around each point, in which a degree of longitude
+    is scaled by cos(lat) of the point so that the frame is close to metric near the point; the
+    distance to the nearest point is then calculated geodesically. Points inside the geometry are
+    0 km from it.
+    '''
+    lons = shapely.get_x(points)
+    lats = shapely.get_y(points)
+    scale = np.cos(np.radians(np.clip(lats, -89.9, 89.9)))
+    _, index = shapely.get_coordinates(geoms, return_index=True)
+
+    def to_local(coords):
+        return np.column_stack([(coords[:, 0] - lons[index]) * scale[index], coords[:, 1] - lats[index]])
+
+    local = shapely.transform(geoms, to_local)
+    lines = shapely.shortest_line(shapely.points(np.zeros(len(lons)), np.zeros(len(lons))), local)
+    nearest = shapely.get_coordinates(lines).reshape(-1, 2, 2)[:, 1]
+    _, _, metres = GEOD.inv(lons, lats, lons + nearest[:, 0] / scale, lats + nearest[:, 1])
+    return np.asarray(metres) / 1000.0
+
+
+class ProximityEngine:
+    '''
+    Distances [km] from many sample points to a fixed set of MarineRegions geometries (WGS84).
+
+    Everything is done for all points at once on arrays:
+      - an STRtree of the geometries finds the planar (degree) nearest region of each point.
+        The tree is planar in lon/lat, so every point is also queried as its copy on the other
+        side of the antimeridian (lon -/+ 360): regions just across +-180 deg are found too.
+        Geometries themselves must be in -180..180 (MarineRegions splits regions at the
+        antimeridian)
+      - the degree distance is widened by 1/cos of the highest latitude the search can reach so
+        that no region that could be geodesically nearer is missed, and all regions within that
+        reach are collected
+      - for every (point, region) candidate pair the nearest point on the region is found in a
+        local frame around the point and the geodesic distance on the WGS84 ellipsoid to it is
+        calculated (see geodesic_km)
+    Points inside a region are 0 km from it.
+    '''
+
+    def __init__(self, geometries, coarse=None, coarse_error=0.0):
+        '''
+        geometries: {MRGID: shapely geometry}. Missing (None) or empty geometries are skipped.
+
+        coarse: optional {MRGID: simplified geometry}, none of which is further than coarse_error
+        [deg] from its full geometry. The search is then done on the coarse geometries, and a
+        full geometry is only read (geometries can be a lazy mapping) for the candidates that
+        can't be decided on the coarse level: points clearly inside a coarse region are 0 km
+        away, regions that are clearly further than another one are dropped.
+        '''
+        self.full = None
+        self.error = 0.0
+        if coarse is not None:
+            self.full = geometries
+            self.error = float(coarse_error)
+            geometries = coarse
+        geometries = {mrgid: geom for mrgid, geom in geometries.items()
+                      if geom is not None and not geom.is_empty}
+        self.mrgids = np.array(list(geometries.keys()))
+        self.geoms = np.array(list(geometries.values()), dtype=object)
+        self.tree = shapely.STRtree(self.geoms)
+
+    def __len__(self):
+        return len(self.geoms)
+
+    def candidates(self, points, lats):
+        '''
+        (point index, geometry index) pairs that could hold the geodesic nearest region of each point.
+        '''
+        (p_idx, g_idx), d_deg = self.tree.query_nearest(points, return_distance=True)
+        # The planar nearest region is at most reach_km away. Any region that is geodesically
+        # nearer lies within reach_km, so below lat_reach, where a degree of longitude is at
+        # least MIN_KM_PER_DEG * cos(lat_reach) long: its degree distance is at most reach.
+        reach_km = (d_deg + self.error) * KM_PER_DEG
+        lat_reach = np.abs(lats[p_idx]) + reach_km / MIN_KM_PER_DEG
+        cos_reach = np.maximum(np.cos(np.radians(np.minimum(lat_reach, 90.0))), 1e-9)
+        reach = np.zeros(len(points))
+        reach[p_idx] = np.where(
+            lat_reach < 89.0,
+            reach_km / MIN_KM_PER_DEG * np.sqrt(1.0 + 1.0 / cos_reach ** 2) + self.error,
+            # Around a pole a region can be near in any direction
+            540.0)
+        return self.tree.query(points, predicate='dwithin', distance=reach)
+
+    def refine(self, points, p_idx, g_idx, coarse_km):
+        '''
+        Turn distances to the coarse geometries into distances to the full ones. Pairs that can't
+        hold the nearest region get an infinite distance without ever reading the full geometry.
+        '''
+        coarse = self.geoms[g_idx]
+        inside = (shapely.covers(coarse, points[p_idx]) &
+                  (shapely.distance(shapely.boundary(coarse), points[p_idx]) > self.error))
+        error_km = self.error * KM_PER_DEG
+
+        upper = np.full(len(points), np.inf)
+        np.minimum.at(upper, p_idx, np.where(inside, 0.0, coarse_km + error_km))
+        borderline = ~inside & (coarse_km - error_km <= upper[p_idx] + TIE_KM)
+
+        pair_km = np.where(inside, 0.0, np.inf)
+        if borderline.any():
+            mrgids = self.mrgids[g_idx[borderline]]
+            full = {mrgid: self.full[mrgid] for mrgid in set(mrgids.tolist())}
+            full_geoms = np.array([full[mrgid] for mrgid in mrgids.tolist()], dtype=object)
+            pair_km[borderline] = geodesic_km(points[p_idx[borderline]], full_geoms)
+        log.debug(f'Refined {borderline.sum()} of {len(p_idx)} candidate pairs at full resolution')
+        return pair_km
+
+    def nearest(self, lons, lats):
+        '''
+        Distance [km] from each point to the nearest region, and the MRGIDs of the nearest region/s.
+        Returns (distance_km array, list of MRGID lists). The distance is NaN, and the list empty,
+        when the engine has no regions.
+        '''
+        lons = np.asarray(lons, dtype=float)
+        lats = np.asarray(lats, dtype=float)
+        distance_km = np.full(len(lons), np.nan)
+        nearest_mrgids = [[] for _ in range(len(lons))]
+        if len(self) == 0 or len(lons) == 0:
+            return distance_km, nearest_mrgids
+
+        # Query point i and its copy across the antimeridian (i + len(lons)) alike; the geodesic
+        # distances don't depend on the copy as GEOD wraps longitudes.
+        query_lons = np.concatenate([lons, np.where(lons > 0, lons - 360.0, lons + 360.0)])
+        query_lats = np.concatenate([lats, lats])
+        points = shapely.points(query_lons, query_lats)
+        p_idx, g_idx = self.candidates(points, query_lats)
+        pair_km = geodesic_km(points[p_idx], self.geoms[g_idx])
+        if self.full is not None:
+            pair_km = self.refine(points, p_idx, g_idx, pair_km)
+        p_idx = p_idx % len(lons)
+
+        best = np.full(len(lons), np.inf)
+        np.minimum.at(best, p_idx, pair_km)
+        found = np.isfinite(best)
+        distance_km[found] = best[found]
+
+        is_nearest = pair_km <= best[p_idx] + TIE_KM
+        for point, mrgid in zip(p_idx[is_nearest], self.mrgids[g_idx[is_nearest]]):
+            if mrgid.item() not in nearest_mrgids[point]:
+                nearest_mrgids[point].append(mrgid.item())
+        return distance_km, nearest_mrgids
+
+    def within(self, lons, lats, buffer_km):
+        '''
+        Is each point within buffer_km of any of the regions?
+        '''
+        distance_km, _ = self.nearest(lons, lats)
+        return np.nan_to_num(distance_km, nan=np.inf) <= buffer_km
@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+import email.utils
+from urllib.parse import urlparse
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, fall back to a per-process limiter
+    fcntl = None
+
+log = logging.getLogger('ratelimit')
+
+
+def parse_retry_after(value):
+    '''
+    Convert a Retry-After header (delta-seconds or HTTP-date) to a number of seconds.
+    Returns None when the header is missing or can't be parsed.
+    '''
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        log.warning(f'Could not parse Retry-After header: {value}')
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def host_of(url):
+    '''
+    The upstream of url: its host name without a leading www. WoRMS and MarineRegions answer on
+    both www.marinespecies.org and marinespecies.org, and both names share one rate limit.
+    '''
+    netloc = urlparse(url).netloc.lower()
+    return netloc[len('www.'):] if netloc.startswith('www.') else netloc
+
+
+class RateLimiter:
+    '''
+    Token bucket rate limiter with one bucket per host (see host_of).
+
+    The rate of a bucket adapts to what the upstream tells us (AIMD):
+      - every successful request nudges the rate up towards max_rate
+      - every 429 halves the rate and blocks the host for Retry-After seconds
+
+    If state_file is given the buckets are kept in that file (guarded by flock) so that
+    all worker processes on the machine share one budget per host. Otherwise the buckets
+    only live in this process, shared between its threads.
+    '''
+
+    def __init__(self, rate=5.0, max_rate=20.0, min_rate=0.2, burst=None, increase=0.5, state_file=None):
+        self.rate = float(rate)
+        self.max_rate = max(float(max_rate), self.rate)
+        self.min_rate = min(float(min_rate), self.rate)
+        self.burst = float(burst) if burst is not None else max(1.0, self.rate)
+        self.increase = float(increase)
+        self.state_file = state_file
+        if self.state_file is not None and fcntl is None:
+            log.warning('No flock on this platform, rate limit state will not be shared between processes...')
+            self.state_file = None
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    @contextlib.contextmanager
+    def _state(self):
+        '''
+        Yield the dict of buckets, locked against other threads (and processes when a
+        state_file is used). Changes are written back when the block exits.
+        '''
+        with self._lock:
+            if self.state_file is None:
+                yield self._buckets
+                return
+            with open(self.state_file, 'a+', encoding='utf8') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        buckets = json.loads(f.read() or '{}')
+                    except json.JSONDecodeError:
+                        log.warning(f'Corrupt rate limit state in {self.state_file}, resetting...')
+                        buckets = {}
+                    yield buckets
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(buckets))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _bucket(self, buckets, host, now):
+        '''
+        Get the bucket for host, refilled up to now.
+        '''
+        bucket = buckets.setdefault(host, {'rate': self.rate,
+                                           'tokens': self.burst,
+                                           'updated': now,
+                                           'blocked_until': 0.0})
+        elapsed = max(0.0, now - bucket['updated'])
+        bucket['tokens'] = min(self.burst, bucket['tokens'] + elapsed * bucket['rate'])
+        bucket['updated'] = now
+        return bucket
+
+    def acquire(self, url, timeout=None):
+        '''
+        Block until a request to the host of url is allowed, and return True. With a timeout [s],
+        give up (without waiting) and return False when that would take longer than timeout.
+        '''
+        host = host_of(url)
+        give_up = time.time() + timeout if timeout is not None else None
+        while True:
+            with self._state() as buckets:
+                now = time.time()
+                bucket = self._bucket(buckets, host, now)
+                wait = bucket['blocked_until'] - now
+                if wait <= 0:
+                    if bucket['tokens'] >= 1:
+                        bucket['tokens'] -= 1
+                        return True
+                    wait = (1 - bucket['tokens']) / bucket['rate']
+            if give_up is not None and now + wait > give_up:
+                log.debug(f'    -Rate limit for {host}: not waiting {wait:.2f}s, past the timeout')
+                return False
+            log.debug(f'    -Rate limit for {host}: waiting {wait:.2f}s')
+            time.sleep(wait)
+
+    def try_acquire(self, url):
+        '''
+        Take a token for the host of url if one is available right now. Never waits; returns
+        whether a token was taken.
+        '''
+        host = host_of(url)
+        with self._state() as buckets:
+            now = time.time()
+            bucket = self._bucket(buckets, host, now)
+            if bucket['blocked_until'] <= now and bucket['tokens'] >= 1:
+                bucket['tokens'] -= 1
+                return True
+        return False
+
+    def success(self, url):
+        '''
+        Record a request that was not throttled and probe a slightly higher rate.
+        '''
+        host = host_of(url)
+        with self._state() as buckets:
+            bucket = self._bucket(buckets, host, time.time())
+            bucket['rate'] = min(self.max_rate, bucket['rate'] + self.increase / bucket['rate'])
+
+    def backoff(self, url, retry_after=None):
+        '''
+        Record a 429 from the host of url: halve the rate, drop saved up tokens and
+        don't allow any requests until Retry-After has passed.
+        '''
+        host = host_of(url)
+        delay = parse_retry_after(retry_after)
+        with self._state() as buckets:
+            now = time.time()
+            bucket = self._bucket(buckets, host, now)
+            bucket['rate'] = max(self.min_rate, bucket['rate'] / 2)
+            bucket['tokens'] = 0.0
+            if delay is None:
+                delay = 1 / bucket['rate']
+            bucket['blocked_until'] = max(bucket['blocked_until'], now + delay)
+            log.warning(f'Throttled by {host}: rate now {bucket["rate"]:.2f} req/s, pausing {delay:.1f}s')
+
+    def current_rate(self, url):
+        '''
+        The request rate [req/s] currently allowed for the host of url.
+        '''
+        host = host_of(url)
+        with self._state() as buckets:
+            return self._bucket(buckets, host, time.time())['rate']
+
+
+def from_env():
+    '''
+    Build a RateLimiter from the RATE_LIMIT, RATE_LIMIT_MAX and RATE_LIMIT_STATE env variables.
+    '''
+    return RateLimiter(rate=float(os.getenv('RATE_LIMIT', 5)),
+                       max_rate=float(os.getenv('RATE_LIMIT_MAX', 20)),
+                       state_file=os.getenv('RATE_LIMIT_STATE') or None)
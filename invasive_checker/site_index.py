@@ -0,0 +1,131 @@
+import json
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from invasive_checker import invasive_checker
+
+log = logging.getLogger('site_index')
+
+NO_DISTRIBUTION = 'No distribution found for this Aphia_ID'
+
+
+def fetch_distribution(aphia_id):
+    '''
+    (records, answered) for one AphiaID. get_aphia_distribution returns None both when WoRMS
+    has no distribution for the AphiaID and when the lookup failed or was deferred; answered
+    tells them apart: it is only True when there is a reply from WoRMS in the lookup cache.
+    '''
+    records = invasive_checker.get_aphia_distribution(aphia_id)
+    if records is not None:
+        return records, True
+    return None, invasive_checker.lookup_cache.peek(invasive_checker.distribution_url(aphia_id)) is not None
+
+
+class SiteIndex:
+    '''
+    Inverted index of WRIMS distributions: MRGID -> {AphiaID: [establishmentMeans, ...]}
+
+    check_aphia answers "what is the status of this AphiaID here?" one AphiaID at a time.
+    The usual question for a sample is "which of the taxa found here are introduced here?",
+    which the index answers with a single probe per MRGID of the site:
+
+        index = SiteIndex.from_aphia_ids(aphia_ids)
+        statuses = index.check_site(2.5, 51.5, aphia_ids)
+
+    establishmentMeans are cleaned up the same way as in check_aphia (Alien -> Introduced,
+    None -> Recorded) so each value of statuses matches the status_dict of check_aphia, the
+    only difference being that Status/Within are in MRGID order.
+    '''
+
+    def __init__(self):
+        self.index = {}
+        self.aphia_ids = set()
+        self.missing = set()
+
+    def add(self, aphia_id, records):
+        '''
+        Add the distribution records (as returned by invasive_checker.get_aphia_distribution)
+        of one AphiaID. records=None marks the AphiaID as having no distribution.
+        '''
+        if records is None:
+            self.missing.add(aphia_id)
+            return
+        self.aphia_ids.add(aphia_id)
+        self.missing.discard(aphia_id)
+        for record in records:
+            means = invasive_checker.establishment_means(record.get('establishmentMeans'))
+            self.index.setdefault(record['MRGID'], {}).setdefault(aphia_id, []).append(means)
+
+    def fetch(self, aphia_ids, workers=8):
+        '''
+        Get the WRIMS distributions of the AphiaIDs that are not in the index yet. AphiaIDs whose
+        lookup failed are left out, so they are fetched again next time.
+        '''
+        todo = sorted(set(aphia_ids) - self.aphia_ids - self.missing, key=str)
+        if len(todo) == 0:
+            return
+        log.info(f'Fetching distributions for {len(todo)} AphiaIDs...')
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Each lookup runs in a copy of our context, so its spans are part of the caller's trace
+            futures = [executor.submit(contextvars.copy_context().run, fetch_distribution, aphia_id)
+                       for aphia_id in todo]
+            for aphia_id, (records, answered) in zip(todo, (future.result() for future in futures)):
+                if answered:
+                    self.add(aphia_id, records)
+                else:
+                    log.warning(f'No distribution for AphiaID {aphia_id} this time, not marking it as missing')
+
+    @classmethod
+    def from_aphia_ids(cls, aphia_ids, workers=8):
+        index = cls()
+        index.fetch(aphia_ids, workers)
+        return index
+
+    def statuses(self, site_mrgids, aphia_ids):
+        '''
+        Status of each AphiaID at a site given by its MRGIDs. Returns {AphiaID: status_dict}
+        '''
+        wanted = set(aphia_ids)
+        results = {aphia_id: {'Status': [], 'Within': []} for aphia_id in wanted & self.aphia_ids}
+        for mrgid in sorted(set(site_mrgids) & self.index.keys()):
+            entries = self.index[mrgid]
+            for aphia_id in wanted & entries.keys():
+                for means in entries[aphia_id]:
+                    results[aphia_id]['Status'].append(means)
+                    results[aphia_id]['Within'].append(mrgid)
+        for aphia_id in wanted - self.aphia_ids:
+            results[aphia_id] = {'aphia_id': aphia_id,
+                                 'Error': NO_DISTRIBUTION}
+        return results
+
+    def check_site(self, lon, lat, aphia_ids, fetch=True):
+        '''
+        Status of every AphiaID at the sample location. AphiaIDs that aren't indexed yet are
+        fetched first, unless fetch=False in which case they are reported as having no distribution.
+        '''
+        if fetch:
+            self.fetch(aphia_ids)
+        site_mrgids = invasive_checker.get_sample_mrgids(lat, lon)
+        return self.statuses(site_mrgids, aphia_ids)
+
+    def to_json(self, path):
+        with open(path, 'w', encoding='utf8') as f:
+            json.dump({'aphia_ids': sorted(self.aphia_ids),
+                       'missing': sorted(self.missing),
+                       'index': self.index}, f)
+
+    @classmethod
+    def from_json(cls, path):
+        '''
+        Load an index written with to_json. JSON object keys are strings, so MRGIDs and AphiaIDs
+        are turned back into ints.
+        '''
+        with open(path, encoding='utf8') as f:
+            stored = json.load(f)
+        index = cls()
+        index.aphia_ids = set(stored['aphia_ids'])
+        index.missing = set(stored['missing'])
+        index.index = {int(mrgid): {int(aphia_id): means for aphia_id, means in entries.items()}
+                       for mrgid, entries in stored['index'].items()}
+        return index
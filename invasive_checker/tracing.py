@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import uuid
+import inspect
+import numbers
+import logging
+import threading
+import functools
+import contextlib
+import contextvars
+
+log = logging.getLogger('tracing')
+
+'''
+Lightweight tracing of lookups, written as JSON lines so slow rows can be analysed offline.
+
+A span is one timed step (a lineage level, a distribution fetch, an HTTP request...). The
+first span in a context starts a new trace; spans opened inside it share its trace_id and point
+to their parent, so every request can be linked back to the OTU/accession that caused it.
+Each line of the trace file is one finished span:
+
+    {"trace_id": ..., "span_id": ..., "parent_id": ..., "name": "get_aphia_status",
+     "start": <epoch s>, "duration_ms": 812.4, "pid": ..., "thread": ...,
+     "attrs": {"aphia_id": 107451, "cache": "miss"}}
+
+Tracing is off (and close to free) until a TRACE_FILE is configured.
+'''
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+# Argument types that are written as span attributes by traced()
+SIMPLE_TYPES = (str, numbers.Number, type(None))
+
+
+class Tracer:
+    '''
+    Appends finished spans to a JSON lines file.
+    '''
+
+    def __init__(self, path=None):
+        self._lock = threading.Lock()
+        self._file = None
+        self.path = None
+        self.configure(path)
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def configure(self, path):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.path = path or None
+        if self.path is not None:
+            log.info(f'Writing trace spans to {self.path}')
+
+    def write(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            if self.path is None:
+                return
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf8')
+            self._file.write(line + '\n')
+            self._file.flush()
+
+
+tracer = Tracer(os.getenv('TRACE_FILE'))
+
+
+def configure(path):
+    '''
+    Write spans to path (JSON lines, appended). None switches tracing off.
+    '''
+    tracer.configure(path)
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    '''
+    Time the block as a span. Yields the attrs dict, which can be added to inside the block.
+    '''
+    if not tracer.enabled:
+        yield attrs
+        return
+
+    parent = _current_span.get()
+    record = {'trace_id': parent['trace_id'] if parent is not None else uuid.uuid4().hex,
+              'span_id': uuid.uuid4().hex[:16],
+              'parent_id': parent['span_id'] if parent is not None else None,
+              'name': name,
+              'start': time.time(),
+              'duration_ms': None,
+              'pid': os.getpid(),
+              'thread': threading.current_thread().name,
+              'attrs': attrs}
+    token = _current_span.set(record)
+    started = time.perf_counter()
+    try:
+        yield attrs
+    except Exception as err:
+        attrs['error'] = repr(err)
+        raise
+    finally:
+        record['duration_ms'] = round(1000 * (time.perf_counter() - started), 3)
+        _current_span.reset(token)
+        tracer.write(record)
+
+
+def annotate(**attrs):
+    '''
+    Add attributes to the current span, if there is one.
+    '''
+    record = _current_span.get()
+    if record is not None:
+        record['attrs'].update(attrs)
+
+
+def traced(attrs=None, **defaults):
+    '''
+    Decorator that runs the function in a span named after it. Arguments of simple types are
+    recorded as attributes, as are the defaults given here. attrs can be a function that takes
+    the same arguments and returns more attributes.
+
+        @traced(cache='hit')
+        def get_aphia_status(aphia_id): ...
+    '''
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            span_attrs = dict(defaults)
+            for key, value in signature.bind(*args, **kwargs).arguments.items():
+                if isinstance(value, SIMPLE_TYPES):
+                    span_attrs[key] = value
+            if attrs is not None:
+                span_attrs.update(attrs(*args, **kwargs))
+            with span(func.__name__, **span_attrs):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,8 +1,19 @@
 import logging
+from hashlib import md5
 import pandas as pd
 
 log = logging.getLogger('utils') 
 
+def file_md5(path):
+    '''
+    md5 hexdigest of a file, read in 1MB blocks so big inputs aren't loaded whole.
+    '''
+    digest = md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
 def get_sample_location_df(AccessionIDs, meta_df):
     '''
     Return a dataframe of AccessionID metadata. 
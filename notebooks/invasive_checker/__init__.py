@@ -1,5 +0,0 @@
-"""Top-level package for invasive_checker."""
-
-__author__ = """Rory Meyer"""
-__email__ = 'rory.meyer@vliz.be'
-__version__ = '0.1.0'
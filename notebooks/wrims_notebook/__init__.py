@@ -0,0 +1,6 @@
+"""Helpers of the Excel Processing notebook. Needs the invasive_checker package of the repo root
+(pip install .. from the notebooks folder, see environment.yml)."""
+
+__author__ = """Rory Meyer"""
+__email__ = 'rory.meyer@vliz.be'
+__version__ = '0.1.0'
@@ -0,0 +1,184 @@
+#--- Python libs ---
+import os
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+#--- Pip libs ---
+import pandas as pd
+#--- Custom libs ---
+from . import utils
+
+'''
+Command line version of the "Excel Processing" notebook.
+
+Takes the observatory info workbook and any number of species-per-observatory workbooks
+(one sheet per observatory) and writes a <input>_wrims.xlsx file for each of them.
+
+Compared to the notebook:
+    - All workbooks/sheets are read once up front
+    - AphiaIDs are deduplicated over all sheets and workbooks, so each distribution is
+      only requested once
+    - Distributions and observatory MRGIDs are requested concurrently (the rate limiter
+      in utils.requester keeps us within the WoRMS/MarineRegions limits)
+
+Run from the notebooks folder:
+    python -m wrims_notebook.batch -m ./data/ARMS_ObservatoryInfo.xlsx \
+        ./data/ARMS_SpeciesPerObservatory_18S.xlsx ./data/ARMS_SpeciesPerObservatory_COI.xlsx
+'''
+log = logging.getLogger('batch')
+
+OBSERVATORY_SHEET = 'AveragedObservatoryInfo'
+APHIA_COL = 'AphiaID_accepted'
+
+
+def load_observatories(obs_info, sheet_name=OBSERVATORY_SHEET):
+    '''
+    Read the observatory info sheet: Observatory, Latitude_avg, Longitude_avg
+    '''
+    return pd.read_excel(obs_info, sheet_name=sheet_name)
+
+
+def load_species_workbooks(input_files):
+    '''
+    Read every sheet of every species workbook. Returns {input_file: {sheet_name: df}} with
+    only the rows that have an accepted AphiaID.
+    '''
+    workbooks = {}
+    for input_file in input_files:
+        log.info(f'Reading {input_file}')
+        sheets = pd.read_excel(input_file, sheet_name=None)
+        for key, df_oi in sheets.items():
+            df_oi = df_oi[df_oi[APHIA_COL].notna()].copy()
+            df_oi[APHIA_COL] = df_oi[APHIA_COL].astype(int)
+            sheets[key] = df_oi
+        workbooks[input_file] = sheets
+    return workbooks
+
+
+def fetch_site_mrgids(df_info, workers=8):
+    '''
+    Get the MRGIDs that intersect with each observatory location.
+    '''
+    rows = [row for _, row in df_info.iterrows()]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        replies = executor.map(lambda row: utils.get_mrgids(row.Longitude_avg, row.Latitude_avg), rows)
+
+    mrgid_list = []
+    for row, mrgids_sample_location in zip(rows, replies):
+        if not isinstance(mrgids_sample_location, pd.DataFrame):
+            log.warning(f'No MarineRegions found for observatory {row["Observatory"]}')
+            continue
+        mrgids_sample_location['Observatory'] = row['Observatory']
+        mrgids_sample_location['Latitude_avg'] = row['Latitude_avg']
+        mrgids_sample_location['Longitude_avg'] = row['Longitude_avg']
+        mrgid_list.append(mrgids_sample_location)
+    if len(mrgid_list) == 0:
+        return pd.DataFrame(columns=['MRGID', 'Observatory', 'Latitude_avg', 'Longitude_avg'])
+    return pd.concat(mrgid_list)
+
+
+def fetch_distributions(aphia_ids, workers=8):
+    '''
+    Get the WRIMS distribution of each AphiaID, concatenated into one dataframe with an
+    aphiaID column.
+    '''
+    aphia_ids = sorted(set(aphia_ids))
+    log.info(f'Requesting distributions for {len(aphia_ids)} unique AphiaIDs')
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        replies = executor.map(utils.get_aphia_status, aphia_ids)
+
+    appended_data = []
+    for aphiaID, (xx, url) in zip(aphia_ids, replies):
+        if xx is None:
+            continue
+        xx['aphiaID'] = aphiaID
+        appended_data.append(xx)
+    if len(appended_data) == 0:
+        return pd.DataFrame(columns=['aphiaID', 'MRGID', 'locality', 'establishmentMeans'])
+    return pd.concat(appended_data)
+
+
+def join_sheet(df_oi, wrims_df, mrgid_df, observatory):
+    '''
+    Combine the species of one observatory with the WRIMS distributions that overlap with the
+    MRGIDs of that observatory.
+    '''
+    this_wrims_df = wrims_df[wrims_df['aphiaID'].isin(df_oi[APHIA_COL].unique())]
+    this_mrgid_df = mrgid_df[mrgid_df['Observatory'] == observatory]
+    mrgid_merge = pd.merge(this_wrims_df, this_mrgid_df, how='inner', left_on='MRGID', right_on='MRGID')
+    mrgid_merge['establishmentMeans'] = mrgid_merge['establishmentMeans'].fillna(value='Present')
+    mrgid_merge = mrgid_merge[['aphiaID', 'MRGID', 'locality', 'establishmentMeans']]
+
+    final_df = pd.merge(df_oi, mrgid_merge, how='left', left_on=APHIA_COL, right_on='aphiaID')
+    final_df = final_df.drop(['aphiaID'], axis=1).drop_duplicates()
+    return final_df
+
+
+def output_path(input_file, output_folder=None):
+    '''
+    ./data/ARMS_SpeciesPerObservatory_18S.xlsx -> <output_folder>/ARMS_SpeciesPerObservatory_18S_wrims.xlsx
+    '''
+    folder, filename = os.path.split(input_file)
+    stem, _ = os.path.splitext(filename)
+    return os.path.join(output_folder or folder, f'{stem}_wrims.xlsx')
+
+
+def process_workbooks(obs_info, input_files, output_folder=None, workers=8):
+    '''
+    Do the whole notebook for all input workbooks. Returns the list of files written.
+    '''
+    df_info = load_observatories(obs_info)
+    workbooks = load_species_workbooks(input_files)
+
+    aphia_ids = set()
+    for sheets in workbooks.values():
+        for df_oi in sheets.values():
+            aphia_ids.update(df_oi[APHIA_COL].unique())
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        mrgid_future = executor.submit(fetch_site_mrgids, df_info, workers)
+        wrims_future = executor.submit(fetch_distributions, aphia_ids, workers)
+        mrgid_df = mrgid_future.result()
+        wrims_df = wrims_future.result()
+
+    output_files = []
+    for input_file, sheets in workbooks.items():
+        output_file = output_path(input_file, output_folder)
+        log.info(f'Writing {output_file}')
+        with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
+            for key, df_oi in sheets.items():
+                if key not in set(df_info['Observatory']):
+                    log.warning(f'Sheet {key} of {input_file} is not a known observatory')
+                join_sheet(df_oi, wrims_df, mrgid_df, key).to_excel(writer, sheet_name=key)
+        output_files.append(output_file)
+    return output_files
+
+
+def main(argv=None):
+    PARSER = argparse.ArgumentParser(
+        description='Add WRIMS status to species-per-observatory Excel files')
+    PARSER.add_argument(
+        '-l', '--loglevel', default='INFO',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+        help="Set log level (%s)" % 'INFO')
+    PARSER.add_argument(
+        '-m', '--obs_info', required=True,
+        help="Path to the observatory info Excel file.")
+    PARSER.add_argument(
+        '-o', '--output_folder', default=None,
+        help="Folder to write the _wrims.xlsx files to. Defaults to the folder of each input file.")
+    PARSER.add_argument(
+        '-w', '--workers', default=8, type=int,
+        help="Number of concurrent requests to WoRMS/MarineRegions.")
+    PARSER.add_argument(
+        'input_files', nargs='+',
+        help="Species per observatory Excel files.")
+    args = PARSER.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+                        level=getattr(logging, args.loglevel))
+    for output_file in process_workbooks(args.obs_info, args.input_files, args.output_folder, args.workers):
+        log.info(f'Done: {output_file}')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,17 @@
+import os
 import logging
 import pandas as pd
 import functools
 import requests
-import time
+
+from invasive_checker import ratelimit
 
 log = logging.getLogger('utils') 
 
+# Shared by every request to WoRMS/MarineRegions, one token bucket per host
+limiter = ratelimit.from_env()
+MAX_RETRIES = int(os.getenv('MAX_RETRIES', 3))
+
 def get_sample_location_df(AccessionIDs, meta_df):
     '''
     Return a dataframe of AccessionID metadata. 
@@ -57,20 +63,22 @@ def requester(url):
     '''
     Do a safe request and return the result.
     ''' 
-    reply = requests.get(url)
-    if reply.status_code == 200:
-        try:
-            r = reply
-        except Exception as error:
-            print(error)
-            raise Exception("No known distribution")
-            r = []
-        return r
-    
-    elif reply.status_code == 429:
-        print('Going too fast!')
-        time.sleep(2)
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.acquire(url)
         reply = requests.get(url)
+        if reply.status_code == 429:
+            print('Going too fast!')
+            limiter.backoff(url, reply.headers.get('Retry-After'))
+            continue
+        if reply.status_code >= 500:
+            # Server error: retry, but it is no reason to go faster
+            print(f'Server error {reply.status_code}, retrying...')
+            continue
+        if reply.status_code < 400:
+            limiter.success(url)
+        break
+
+    if reply.status_code == 200:
         try:
             r = reply
         except Exception as error:
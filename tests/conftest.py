@@ -0,0 +1,48 @@
+"""Canned WoRMS/MarineRegions replies so tests don't need the network."""
+
+import pytest
+from invasive_checker import invasive_checker
+
+DISTRIBUTION = [
+    {'locality': 'North Sea', 'locationID': 'http://marineregions.org/mrgid/21912',
+     'higherGeography': 'North Atlantic Ocean', 'higherGeographyID': 'http://marineregions.org/mrgid/1912',
+     'recordStatus': 'valid', 'typeStatus': None, 'establishmentMeans': 'Alien',
+     'decimalLatitude': None, 'decimalLongitude': None, 'qualityStatus': 'checked'},
+    {'locality': 'Belgian Exclusive Economic Zone', 'locationID': 'http://marineregions.org/mrgid/3293',
+     'higherGeography': 'North Sea', 'higherGeographyID': 'http://marineregions.org/mrgid/21912',
+     'recordStatus': 'valid', 'typeStatus': None, 'establishmentMeans': None,
+     'decimalLatitude': None, 'decimalLongitude': None, 'qualityStatus': 'unreviewed'},
+    {'locality': 'Westerschelde', 'locationID': 'http://marineregions.org/mrgid/4752',
+     'higherGeography': 'North Sea', 'higherGeographyID': 'http://marineregions.org/mrgid/21912',
+     'recordStatus': 'valid', 'typeStatus': None, 'establishmentMeans': 'Native',
+     'decimalLatitude': None, 'decimalLongitude': None, 'qualityStatus': 'unreviewed'},
+    {'locality': 'European waters (ERMS scope)', 'locationID': 'http://marineregions.org/mrgid/7130',
+     'higherGeography': None, 'higherGeographyID': None,
+     'recordStatus': 'deleted', 'typeStatus': None, 'establishmentMeans': 'Native',
+     'decimalLatitude': None, 'decimalLongitude': None, 'qualityStatus': 'unreviewed'},
+]
+SAMPLE_MRGIDS = [{'MRGID': 21912}, {'MRGID': 3293}, {'MRGID': 7130}, {'MRGID': 3293}]
+
+
+class FakeReply:
+    status_code = 200
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+@pytest.fixture
+def canned(monkeypatch):
+    def requester(url):
+        if 'AphiaDistributionsByAphiaID/107451' in url:
+            # Duplicated records are dropped
+            return FakeReply(DISTRIBUTION + DISTRIBUTION[:1])
+        if 'AphiaDistributionsByAphiaID' in url:
+            return None
+        if 'getGazetteerRecordsByLatLong' in url:
+            return FakeReply(SAMPLE_MRGIDS)
+        raise AssertionError(url)
+    monkeypatch.setattr(invasive_checker, 'requester', requester)
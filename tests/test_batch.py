@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+"""Tests for the `batch` module of the notebook helpers (`wrims_notebook`)."""
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+from invasive_checker import invasive_checker
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'notebooks'))
+from wrims_notebook import batch  # noqa: E402
+
+
+@pytest.fixture
+def canned_notebook(canned, monkeypatch):
+    # The canned WoRMS/MarineRegions replies of conftest, for the notebook requester too
+    monkeypatch.setattr(batch.utils, 'requester', invasive_checker.requester)
+
+
+def species_sheet():
+    return pd.DataFrame({'NCBI_taxID': [6760, 103714, 103714], 'Scientific_name': ['crab', 'squirt', 'squirt'],
+                         batch.APHIA_COL: [107451, 103714, 103714], 'Count': [4, 1, 1]})
+
+
+def test_fetch_distributions(canned_notebook):
+    wrims_df = batch.fetch_distributions([107451, 103714, 107451], workers=2)
+    # Only 107451 has a distribution; deleted and duplicated records are dropped
+    assert set(wrims_df['aphiaID']) == {107451}
+    assert sorted(wrims_df['MRGID']) == [3293, 4752, 21912]
+
+
+def test_fetch_distributions_without_any(canned_notebook):
+    wrims_df = batch.fetch_distributions([103714])
+    assert wrims_df.empty
+    assert list(wrims_df.columns) == ['aphiaID', 'MRGID', 'locality', 'establishmentMeans']
+
+
+def test_join_sheet(canned_notebook):
+    df_info = pd.DataFrame({'Observatory': ['ARMS_Oostende', 'ARMS_Elsewhere'],
+                            'Latitude_avg': [51.2, 10.0], 'Longitude_avg': [2.9, 10.0]})
+    mrgid_df = batch.fetch_site_mrgids(df_info, workers=2)
+    wrims_df = batch.fetch_distributions([107451, 103714])
+
+    final_df = batch.join_sheet(species_sheet(), wrims_df, mrgid_df, 'ARMS_Oostende')
+    crab = final_df[final_df[batch.APHIA_COL] == 107451].sort_values('MRGID')
+    # The North Sea and the Belgian EEZ overlap with the site, the Westerschelde doesn't
+    assert list(crab['MRGID']) == [3293, 21912]
+    # No establishmentMeans means the species is known to be present
+    assert list(crab['establishmentMeans']) == ['Present', 'Alien']
+    squirt = final_df[final_df[batch.APHIA_COL] == 103714]
+    assert len(squirt) == 1
+    assert squirt['MRGID'].isna().all()
+
+    # Sites are joined on their own MRGIDs only
+    assert batch.join_sheet(species_sheet(), wrims_df, mrgid_df, 'ARMS_Unknown')['MRGID'].isna().all()
+
+
+def test_output_path():
+    assert batch.output_path('./data/ARMS_SpeciesPerObservatory_18S.xlsx') == \
+        os.path.join('./data', 'ARMS_SpeciesPerObservatory_18S_wrims.xlsx')
+    assert batch.output_path('./data/ARMS_SpeciesPerObservatory_18S.xlsx', '/tmp/out') == \
+        os.path.join('/tmp/out', 'ARMS_SpeciesPerObservatory_18S_wrims.xlsx')
+    assert batch.output_path('species.xlsx') == 'species_wrims.xlsx'
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+"""Tests for the `cache` module."""
+
+import time
+import threading
+import pytest
+from invasive_checker import cache
+
+URL = 'https://www.marinespecies.org/rest/AphiaDistributionsByAphiaID/107451'
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1e9
+
+    def __call__(self):
+        return self.now
+
+
+class Upstream:
+    def __init__(self):
+        self.calls = 0
+        self.down = False
+
+    def __call__(self, url):
+        self.calls += 1
+        if self.down:
+            raise cache.UpstreamError('down')
+        return cache.CachedReply(url, 200, f'[{self.calls}]')
+
+
+def make_cache(**kwargs):
+    clock = Clock()
+    return cache.LookupCache(clock=clock, **kwargs), clock
+
+
+def wait_for_revalidation(lookup_cache):
+    lookup_cache._executor.submit(lambda: None).result()
+    while lookup_cache._refreshing:
+        time.sleep(0.01)
+
+
+def test_hit_and_miss():
+    lookup_cache = cache.LookupCache()
+    upstream = Upstream()
+    assert lookup_cache.get(URL, upstream).json() == [1]
+    assert lookup_cache.get(URL, upstream).json() == [1]
+    assert upstream.calls == 1
+    assert lookup_cache.peek('https://www.marinespecies.org/other') is None
+
+
+def test_stale_when_upstream_down():
+    lookup_cache, clock = make_cache(ttl=100, hot_hits=100)
+    upstream = Upstream()
+    lookup_cache.get(URL, upstream)
+    clock.now += 100
+    upstream.down = True
+    with lookup_cache.track() as lookups:
+        reply = lookup_cache.get(URL, upstream)
+    assert reply.stale and reply.json() == [1]
+    assert lookups.stale == [URL]
+
+    with pytest.raises(cache.UpstreamError):
+        lookup_cache.get('https://www.marinespecies.org/other', upstream)
+
+
+def test_refresh_ahead_for_hot_entries():
+    lookup_cache, clock = make_cache(ttl=100, refresh_ahead=0.5, hot_hits=2)
+    upstream = Upstream()
+    lookup_cache.get(URL, upstream)
+    clock.now += 75
+    # Still fresh, so served as is, but hot and close to expiry: refreshed in the background
+    assert lookup_cache.get(URL, upstream).json() == [1]
+    assert lookup_cache.get(URL, upstream).json() == [1]
+    wait_for_revalidation(lookup_cache)
+    assert upstream.calls == 2
+    reply = lookup_cache.get(URL, upstream)
+    assert reply.json() == [2] and not reply.stale
+
+
+def test_expired_hot_entry_served_stale_while_revalidating():
+    lookup_cache, clock = make_cache(ttl=100, hot_hits=1)
+    upstream = Upstream()
+    lookup_cache.get(URL, upstream)
+    clock.now += 100
+    assert lookup_cache.get(URL, upstream).stale
+    wait_for_revalidation(lookup_cache)
+    assert lookup_cache.get(URL, upstream).json() == [2]
+
+
+def test_folder(tmp_path):
+    upstream = Upstream()
+    cache.LookupCache(folder=str(tmp_path)).get(URL, upstream)
+    reply = cache.LookupCache(folder=str(tmp_path)).get(URL, upstream)
+    assert reply.json() == [1] and reply.url == URL
+    assert upstream.calls == 1
+
+
+def test_cache_only_after_deadline():
+    lookup_cache, clock = make_cache(ttl=100)
+    upstream = Upstream()
+    lookup_cache.get(URL, upstream)
+    clock.now += 100
+    lookup_cache.set_deadline(clock.now)
+    other = 'https://www.marinespecies.org/other'
+    with lookup_cache.track() as outer:
+        with lookup_cache.track() as lookups:
+            # Expired, but nothing is fetched after the deadline
+            assert lookup_cache.get(URL, upstream).stale
+            with pytest.raises(cache.Deferred):
+                lookup_cache.get(other, upstream)
+    assert upstream.calls == 1
+    assert lookups.deferred == [other] and lookups.stale == [URL]
+    # Nested blocks pass what happened on to the outer one
+    assert outer.deferred == [other] and outer.stale == [URL]
+
+    lookup_cache.set_deadline(None)
+    assert lookup_cache.get(other, upstream).json() == [2]
+
+
+def test_least_recently_used_entries_are_dropped(tmp_path):
+    lookup_cache = cache.LookupCache(max_entries=2, folder=str(tmp_path))
+    upstream = Upstream()
+    urls = [f'{URL}?{i}' for i in range(3)]
+    lookup_cache.get(urls[0], upstream)
+    lookup_cache.get(urls[1], upstream)
+    lookup_cache.get(urls[0], upstream)
+    lookup_cache.get(urls[2], upstream)
+    assert list(lookup_cache._entries) == [urls[0], urls[2]]
+    assert set(lookup_cache._hits) == {urls[0], urls[2]}
+    # Still on disk
+    assert lookup_cache.get(urls[1], upstream).json() == [2]
+    assert upstream.calls == 3
+
+    lookup_cache = cache.LookupCache(max_bytes=7)
+    for url in urls:
+        lookup_cache.get(url, upstream)
+    assert list(lookup_cache._entries) == urls[1:]
+    assert lookup_cache._bytes == 6
+
+
+def test_concurrent_misses_share_one_fetch():
+    lookup_cache = cache.LookupCache()
+    release = threading.Event()
+    upstream = Upstream()
+
+    def slow_upstream(url):
+        release.wait(5)
+        return upstream(url)
+    replies = []
+    threads = [threading.Thread(target=lambda: replies.append(lookup_cache.get(URL, slow_upstream).json()))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while URL not in lookup_cache._inflight:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert replies == [[1]] * 4
+    assert upstream.calls == 1
+    assert lookup_cache._inflight == {}
+
+
+def test_concurrent_misses_share_the_error():
+    lookup_cache = cache.LookupCache()
+    upstream = Upstream()
+    upstream.down = True
+    with pytest.raises(cache.UpstreamError):
+        lookup_cache.get(URL, upstream)
+    # Errors aren't kept: the next miss fetches again
+    upstream.down = False
+    assert lookup_cache.get(URL, upstream).json() == [2]
+
+
+def test_fetch_defers_instead_of_waiting_past_the_deadline(monkeypatch):
+    from invasive_checker import invasive_checker, ratelimit
+    lookup_cache = cache.LookupCache()
+    lookup_cache.set_deadline(time.time() + 1)
+    limiter = ratelimit.RateLimiter()
+    # Throttled for longer than the time left
+    limiter.backoff(URL, retry_after='30')
+    monkeypatch.setattr(invasive_checker, 'lookup_cache', lookup_cache)
+    monkeypatch.setattr(invasive_checker, 'limiter', limiter)
+
+    start = time.time()
+    with lookup_cache.track() as lookups:
+        assert invasive_checker.requester(URL) is None
+    assert time.time() - start < 0.5
+    assert lookups.deferred == [URL]
+
+
+def test_stale_reply_instead_of_a_deferred_refetch(monkeypatch):
+    from invasive_checker import invasive_checker, ratelimit
+    lookup_cache = cache.LookupCache(ttl=100)
+    lookup_cache._store(URL, cache.CachedReply(URL, 200, '[1]', fetched_at=time.time() - 200))
+    lookup_cache.set_deadline(time.time() + 1)
+    limiter = ratelimit.RateLimiter()
+    limiter.backoff(URL, retry_after='30')
+    monkeypatch.setattr(invasive_checker, 'lookup_cache', lookup_cache)
+    monkeypatch.setattr(invasive_checker, 'limiter', limiter)
+
+    with lookup_cache.track() as lookups:
+        assert invasive_checker.requester(URL).stale
+    # Served (Unverified), so not deferred as well
+    assert lookups.stale == [URL] and lookups.deferred == []
+
+
+def test_lineage_walk_stops_at_deferred_level(monkeypatch):
+    from invasive_checker import invasive_checker
+    lookup_cache = cache.LookupCache()
+    url = invasive_checker.taxamatch_url('Eukaryota')
+    lookup_cache._store(url, cache.CachedReply(url, 200, '[[{"AphiaID": 2}]]'))
+    lookup_cache.set_deadline(time.time())
+    monkeypatch.setattr(invasive_checker, 'lookup_cache', lookup_cache)
+
+    with lookup_cache.track() as lookups:
+        # Not 'Eukaryota': the lower levels haven't been looked up
+        assert invasive_checker.get_aphia_from_lineage('Eukaryota;Ascidiella;Ascidiella scabra') is None
+    assert lookups.deferred == [invasive_checker.taxamatch_url('Ascidiella scabra')]
+    assert invasive_checker.get_aphia_from_lineage('Eukaryota')['AphiaID'] == 2
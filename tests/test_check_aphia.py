@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+
+"""Offline tests for `check_aphia`, using canned WoRMS/MarineRegions replies."""
+
+from invasive_checker import invasive_checker
+
+
+def test_check_aphia_details(canned):
+    status_dict, invasive_df = invasive_checker.check_aphia(2.5, 51.5, 107451)
+    assert status_dict == {'Status': ['Introduced', 'Recorded'], 'Within': [21912, 3293]}
+    assert list(invasive_df.MRGID) == [21912, 3293]
+    assert 'higherGeography' not in invasive_df.columns
+
+
+def test_check_aphia_without_details(canned):
+    status_dict, invasive_df = invasive_checker.check_aphia(2.5, 51.5, 107451, details=False)
+    assert invasive_df is None
+    assert status_dict == invasive_checker.check_aphia(2.5, 51.5, 107451)[0]
+
+
+def test_check_aphia_no_distribution(canned):
+    for details in (True, False):
+        status_dict, invasive_df = invasive_checker.check_aphia(2.5, 51.5, 126436, details=details)
+        assert status_dict == {'aphia_id': 126436,
+                               'Error': 'No distribution found for this Aphia_ID'}
+        assert invasive_df is None
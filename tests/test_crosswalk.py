@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""Tests for the `crosswalk` module and bulk external ID resolution."""
+
+from invasive_checker import invasive_checker
+from invasive_checker.crosswalk import Crosswalk
+
+
+def test_load_export(tmp_path):
+    export = tmp_path / 'worms_ncbi.csv'
+    export.write_text('AphiaID,ncbi_id\n132762,860360.0\n126436,8049\n107451,\n')
+    crosswalk = Crosswalk.from_csv(str(export), id_source='ncbi', id_col='ncbi_id')
+
+    assert len(crosswalk) == 2
+    assert crosswalk.get(860360, 'ncbi') == 132762
+    assert crosswalk.get('860360', 'ncbi') == 132762
+    assert crosswalk.get('8049', 'ncbi') == 126436
+    assert crosswalk.get(8049.0, 'ncbi') == 126436
+    assert crosswalk.get(8049, 'bold') is None
+
+    crosswalk.to_csv(str(tmp_path / 'crosswalk.csv'))
+    assert Crosswalk.from_csv(str(tmp_path / 'crosswalk.csv')).table == crosswalk.table
+
+
+def test_resolve_external_ids(monkeypatch, tmp_path):
+    crosswalk = Crosswalk(str(tmp_path / 'crosswalk.csv'))
+    crosswalk.add(860360, 'ncbi', 132762)
+    requested = []
+
+    def get_external_status(external_id, id_source):
+        requested.append((external_id, id_source))
+        return {8049: 126436}.get(external_id)
+    other = Crosswalk()
+    other.add('ABC', 'bold', 1)
+    other.to_csv(crosswalk.path)
+    monkeypatch.setattr(invasive_checker, 'id_crosswalk', crosswalk)
+    monkeypatch.setattr(invasive_checker, 'get_external_status', get_external_status)
+
+    resolved = invasive_checker.resolve_external_ids([(860360, 'ncbi'), (8049, 'ncbi'), (1, 'ncbi'),
+                                                      (8049, 'ncbi'), (5, 'nope')])
+    assert resolved == {(860360, 'ncbi'): 132762, (8049, 'ncbi'): 126436, (1, 'ncbi'): None, (5, 'nope'): None}
+    assert sorted(requested) == [(1, 'ncbi'), (8049, 'ncbi')]
+    # Resolved misses are added to the crosswalk
+    assert crosswalk.get(8049, 'ncbi') == 126436
+    # ... and saved, next to what another process saved in the meantime
+    assert Crosswalk.from_csv(crosswalk.path).table == {('ncbi', '860360'): 132762, ('ncbi', '8049'): 126436,
+                                                        ('bold', 'ABC'): 1}
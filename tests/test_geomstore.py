@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""Tests for the `geomstore` module."""
+
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import Point, box
+from invasive_checker.geomstore import GeometryStore
+from invasive_checker.proximity import ProximityEngine
+
+REGIONS = {21912: Point(3, 54).buffer(2, quad_segs=256),
+           3293: box(2.2, 51.1, 3.4, 51.9),
+           5668: Point(10, 45).buffer(1, quad_segs=256)}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = GeometryStore(str(tmp_path))
+    for mrgid, geom in REGIONS.items():
+        store.put(mrgid, geom)
+    return store
+
+
+def test_levels(store, tmp_path):
+    full = store.get(21912)
+    coarse = store.get(21912, level=0)
+    assert full.equals(REGIONS[21912])
+    assert shapely.get_num_coordinates(coarse) < shapely.get_num_coordinates(full)
+    assert shapely.hausdorff_distance(coarse, full) <= store.levels[0]
+    assert store.get(1) is None
+
+    # Another process opening the same folder sees the same geometries
+    other = GeometryStore(str(tmp_path))
+    assert len(other) == 3
+    assert other.get(3293).equals(REGIONS[3293])
+
+
+def test_engine_matches_full_resolution(store):
+    rng = np.random.default_rng(1)
+    lons = rng.uniform(0, 12, 200)
+    lats = rng.uniform(43, 57, 200)
+    expected_km, expected_mrgids = ProximityEngine(REGIONS).nearest(lons, lats)
+    distance_km, nearest_mrgids = store.engine(REGIONS).nearest(lons, lats)
+
+    assert np.allclose(distance_km, expected_km)
+    assert nearest_mrgids == expected_mrgids
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+"""Tests for the `latency` module."""
+
+import time
+import threading
+
+import pytest
+import requests
+
+from invasive_checker import latency, ratelimit
+
+URL = 'https://www.marineregions.org/rest/getGazetteerRecordsByLatLong.json/51.4/3.5/?offset=0'
+
+
+def test_endpoint_drops_lookup_arguments():
+    assert latency.endpoint(URL) == 'marineregions.org/rest/getGazetteerRecordsByLatLong.json'
+    assert latency.endpoint('http://www.marinespecies.org/rest/AphiaDistributionsByAphiaID/107451') == \
+        'marinespecies.org/rest/AphiaDistributionsByAphiaID'
+
+
+def test_histogram_quantiles():
+    histogram = latency.LatencyHistogram()
+    assert histogram.quantile(0.95) is None
+    for _ in range(95):
+        histogram.record(0.1)
+    for _ in range(5):
+        histogram.record(20.0)
+    # Bucket upper bounds, at most 20% above the sample
+    assert 0.1 <= histogram.quantile(0.5) < 0.12
+    assert 0.1 <= histogram.quantile(0.95) < 0.12
+    assert 20.0 <= histogram.quantile(0.99) < 24.0
+    histogram.record(1e6)
+    assert histogram.quantile(1.0) == latency.BOUNDS[-1]
+
+
+def test_timeout_is_tuned_from_samples():
+    budgets = latency.LatencyBudgets(timeout=60, min_timeout=5, min_samples=20)
+    for _ in range(19):
+        budgets.record(URL, 3.0)
+    assert budgets.timeout(URL) == 60
+    budgets.record(URL, 3.0)
+    assert 9.0 <= budgets.timeout(URL) < 11.0
+    # Other endpoints keep their own budget
+    assert budgets.timeout('https://www.marinespecies.org/rest/AphiaRecordsByMatchNames') == 60
+
+
+class Reply:
+    def __init__(self, status_code, text=''):
+        self.status_code = status_code
+        self.text = text
+
+
+def slow_first_get():
+    calls = []
+    lock = threading.Lock()
+
+    def get(url, timeout=None):
+        with lock:
+            calls.append(timeout)
+            first = len(calls) == 1
+        time.sleep(1.0 if first else 0.01)
+        return Reply(200, 'slow' if first else 'fast')
+    return get, calls
+
+
+def tuned_budgets():
+    budgets = latency.LatencyBudgets(hedge=True, min_samples=10)
+    for _ in range(10):
+        budgets.record(URL, 0.02)
+    return budgets
+
+
+def test_slow_request_is_hedged():
+    budgets = tuned_budgets()
+    get, calls = slow_first_get()
+    started = time.perf_counter()
+    reply, hedged = budgets.get(URL, ratelimit.RateLimiter(rate=10), get)
+    assert (reply.text, hedged) == ('fast', True)
+    assert time.perf_counter() - started < 0.5
+    assert len(calls) == 2
+    assert budgets.hedges == budgets.hedges_won == 1
+
+
+def test_no_hedges_for_many_callers_at_the_usual_latency():
+    budgets = latency.LatencyBudgets(hedge=True, min_samples=10)
+    for _ in range(10):
+        budgets.record(URL, 0.2)
+    limiter = ratelimit.RateLimiter(rate=1000)
+
+    def get(url, timeout=None):
+        time.sleep(0.05)
+        return Reply(200)
+    # Far more callers than there would be threads in a pool: none of them waits for a thread
+    callers = [threading.Thread(target=budgets.get, args=(URL, limiter, get)) for _ in range(64)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+    assert budgets.hedges == 0
+    assert budgets.histogram(URL).count == 74
+
+
+def test_no_hedge_without_a_free_token():
+    budgets = tuned_budgets()
+    limiter = ratelimit.RateLimiter(rate=1)
+    limiter.acquire(URL)
+    get, calls = slow_first_get()
+    reply, hedged = budgets.get(URL, limiter, get)
+    assert (reply.text, hedged) == ('slow', False)
+    assert len(calls) == 1
+
+
+def test_no_hedge_until_tuned_or_enabled():
+    get, calls = slow_first_get()
+    reply, hedged = latency.LatencyBudgets(hedge=True).get(URL, ratelimit.RateLimiter(rate=10), get)
+    assert (reply.text, hedged) == ('slow', False)
+    budgets = latency.LatencyBudgets(hedge=False, min_samples=1)
+    budgets.record(URL, 0.01)
+    assert budgets.hedge_delay(URL) is None
+
+
+def test_errors_are_raised_when_all_requests_fail():
+    budgets = tuned_budgets()
+
+    def get(url, timeout=None):
+        time.sleep(0.2)
+        raise requests.Timeout('too slow')
+    with pytest.raises(requests.Timeout):
+        budgets.get(URL, ratelimit.RateLimiter(rate=10), get)
+    assert budgets.histogram(URL).count == 12
+
+
+def test_failed_reply_does_not_win_the_hedge():
+    budgets = tuned_budgets()
+    calls = []
+
+    def get(url, timeout=None):
+        calls.append(url)
+        if len(calls) == 1:
+            time.sleep(0.2)
+            return Reply(200)
+        return Reply(503)
+    started = time.perf_counter()
+    reply, hedged = budgets.get(URL, ratelimit.RateLimiter(rate=10), get)
+    assert (reply.status_code, hedged) == (200, True)
+    assert time.perf_counter() - started >= 0.2
+    assert budgets.hedges_won == 0
+
+
+def test_first_failed_reply_when_none_succeed():
+    budgets = tuned_budgets()
+    statuses = [429, 503]
+
+    def get(url, timeout=None):
+        status_code = statuses.pop(0)
+        time.sleep(0.2 if status_code == 429 else 0.0)
+        return Reply(status_code)
+    reply, hedged = budgets.get(URL, ratelimit.RateLimiter(rate=10), get)
+    assert (reply.status_code, hedged) == (503, True)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""Tests for the row processing of `app/main.py`."""
+
+import os
+import math
+import importlib.util
+
+import pandas as pd
+import rdflib
+
+from invasive_checker import invasive_checker, cache, provenance
+
+spec = importlib.util.spec_from_file_location('main', os.path.join(os.path.dirname(__file__), os.pardir, 'app', 'main.py'))
+main = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(main)
+
+
+def enriched_rows():
+    return pd.DataFrame({'OTU': ['Otu1', 'Otu1', 'Otu2', 'Otu3'],
+                         'AccessionID': ['ERR1', 'ERR2', 'ERR1', 'ERR1'],
+                         'Aphia_ID': [107451, 107451, 126436, 'No Match'],
+                         'longitude': [3.5, 2.0, 3.5, 3.5],
+                         'latitude': [51.4, 50.0, 51.4, 51.4],
+                         'Lookup Status': ['Complete'] * 4})
+
+
+def test_deferred_proximity_lookups_make_rows_pending(monkeypatch):
+    lookup_cache = cache.LookupCache()
+    lookup_cache.set_deadline(0)
+    monkeypatch.setattr(invasive_checker, 'lookup_cache', lookup_cache)
+
+    def get_proximity(lons, lats, aphia_id, buffer):
+        if aphia_id == 107451:
+            # A geometry that isn't cached
+            invasive_checker.requester(invasive_checker.gazetteer_url(51.4, 3.5))
+        return [dict(zip(invasive_checker.PROXIMITY_FIELDS, [True, buffer, 1.5, [3293]]))] * len(lons)
+    monkeypatch.setattr(invasive_checker, 'get_proximity', get_proximity)
+
+    deferred = []
+    wrims_df = main.add_proximity_columns(enriched_rows(), 10.0, deferred)
+    assert list(wrims_df['Lookup Status']) == ['Pending', 'Pending', 'Complete', 'Complete']
+    url = invasive_checker.gazetteer_url(51.4, 3.5)
+    assert deferred == [(url, 'Otu1', 'ERR1'), (url, 'Otu1', 'ERR2')]
+    distances = wrims_df['distance [km] to nearest introduced location']
+    assert math.isnan(distances[0]) and distances[2] == 1.5 and math.isnan(distances[3])
+
+
+def test_proximity_columns_are_always_added():
+    rows = enriched_rows()
+    rows['Aphia_ID'] = 'Pending'
+    wrims_df = main.add_proximity_columns(rows, 10.0)
+    assert list(wrims_df.columns[-4:]) == invasive_checker.PROXIMITY_FIELDS
+    assert wrims_df['buffer [km]'].isna().all()
+    assert list(main.add_proximity_columns(rows.drop(columns='Aphia_ID'), 10.0).columns[-4:]) == \
+        invasive_checker.PROXIMITY_FIELDS
+
+
+def test_no_distribution_lookup_without_an_aphia_id(monkeypatch):
+    monkeypatch.setattr(invasive_checker, 'get_aphia_from_lineage', lambda classification: None)
+
+    def check_aphia(*args, **kwargs):
+        raise AssertionError('No Match has no distribution to look up')
+    monkeypatch.setattr(invasive_checker, 'check_aphia', check_aphia)
+    row = pd.Series({'classification': 'Eukaryota;Something', 'OTU': 'Otu1', 'AccessionID': 'ERR1',
+                     'isNegativeControlGene': False, 'sampleLongitude': 3.5, 'sampleLatitude': 51.4}, name=0)
+    row = main.process_row(row)
+    assert row['Aphia_ID'] == 'No Match'
+    assert row['WRIMS Status at Sample Location'] == ['Unrecorded']
+    assert row['Lookup Status'] == 'Complete'
+
+
+def test_provenance_status_includes_the_proximity_lookups(tmp_path, monkeypatch):
+    lookup_cache = cache.LookupCache()
+    lookup_cache.set_deadline(0)
+    monkeypatch.setattr(invasive_checker, 'lookup_cache', lookup_cache)
+    for name in ('final_table.tsv', 'meta.csv'):
+        (tmp_path / name).write_text('')
+    worms_df = pd.DataFrame({'classification': ['Eukaryota;Eriocheir sinensis'], 'OTU': ['Otu1'], 'ERR1': [4]})
+    unpivot = pd.DataFrame({'classification': ['Eukaryota;Eriocheir sinensis'], 'OTU': ['Otu1'],
+                            'AccessionID': ['ERR1'], 'Count': [4], 'AccessionNumber': ['ERR1'],
+                            'isNegativeControlGene': [False], 'longitude': [3.5], 'latitude': [51.4]})
+    monkeypatch.setattr(main, 'prepare_input', lambda input_file, meta_file, cfg: (worms_df, unpivot.copy()))
+
+    def process_input_row(row):
+        row['Aphia_ID'] = 107451
+        row['WRIMS Status at Sample Location'] = ['Introduced']
+        row['MarineRegions with known occurrence at Sample Location'] = [3293]
+        return row
+    monkeypatch.setattr(main, 'process_input_row', process_input_row)
+
+    def get_proximity(lons, lats, aphia_id, buffer):
+        # A geometry that isn't cached
+        invasive_checker.requester(invasive_checker.gazetteer_url(51.4, 3.5))
+    monkeypatch.setattr(invasive_checker, 'get_proximity', get_proximity)
+
+    cfg = {'SEP': '\t', 'BUFFER_KM': '10', 'RDF_OUTPUT_FILE': 'provenance.nt',
+           'DEFERRED_OUTPUT_FILE': 'deferred.csv', 'WORMS_OUTPUT_FILE': 'worms.csv', 'CLASS_OUTPUT_FILE': 'classification.csv'}
+    main.process_files(str(tmp_path / 'final_table.tsv'), str(tmp_path), str(tmp_path / 'meta.csv'), cfg)
+
+    graph = rdflib.Graph().parse(str(tmp_path / 'provenance.nt'), format='nt')
+    assert list(graph.objects(None, provenance.IC.lookupStatus)) == [rdflib.Literal('Pending')]
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""Tests for the `planner` module."""
+
+import json
+
+from invasive_checker import invasive_checker, cache, ratelimit
+from invasive_checker.planner import LookupPlan, format_seconds
+
+
+def cached_reply(url, status_code=200, payload=None):
+    return cache.CachedReply(url, status_code, json.dumps(payload) if payload is not None else '')
+
+
+def no_requests(url):
+    raise AssertionError(url)
+
+
+def make_plan(monkeypatch):
+    monkeypatch.setattr(invasive_checker, 'requester', no_requests)
+    monkeypatch.setattr(invasive_checker, 'fetch', no_requests)
+    lookup_cache = cache.LookupCache()
+    for url, status_code, payload in [
+            (invasive_checker.taxamatch_url('Eriocheir sinensis'), 204, None),
+            (invasive_checker.taxamatch_url('Eriocheir'), 200, [[{'AphiaID': 107451}]]),
+            (invasive_checker.distribution_url(107451), 200, []),
+            (invasive_checker.taxamatch_url('Eukaryota'), 200, [[{'AphiaID': 2}]]),
+            (invasive_checker.gazetteer_url(51.4, 3.5), 200, [])]:
+        lookup_cache._store(url, cached_reply(url, status_code, payload))
+    return LookupPlan(lookup_cache=lookup_cache, limiter=ratelimit.RateLimiter(rate=2.0))
+
+
+def test_lineage_walk_is_replayed_on_the_cache(monkeypatch):
+    plan = make_plan(monkeypatch)
+    assert plan.walk_lineage('Eukaryota;Eriocheir;Eriocheir sinensis') == (107451, [])
+    # Nothing cached for the lowest level: all levels may be needed
+    assert plan.walk_lineage('Eukaryota;Ascidiella;Ascidiella scabra') == (
+        None, ['Ascidiella scabra', 'Ascidiella', 'Eukaryota'])
+
+
+def test_summary_counts_unique_and_cached_lookups(monkeypatch):
+    plan = make_plan(monkeypatch)
+    for accession in range(3):
+        plan.add_row('Eukaryota;Eriocheir;Eriocheir sinensis', 3.5, 51.4)
+        plan.add_row('Eukaryota;Ascidiella;Ascidiella scabra', 3.5, 51.4)
+        plan.add_row('Eukaryota;Ascidiella;Ascidiella aspersa', 2.0, 50.0)
+    plan.add_row('Eukaryota;Ascidiella;Ascidiella aspersa', None, None, negative_control=True)
+    plan.add_external_ids([(860360, 'ncbi'), (1, 'not a source')])
+
+    summary = plan.summary()
+    assert plan.rows == 10
+    assert summary['lineages']['unique'] == 3
+    assert summary['lineages']['cached'] == 1
+    levels = summary['lineage levels']
+    assert (levels['unique'], levels['cached'], levels['min_calls'], levels['max_calls']) == (6, 3, 2, 3)
+    aphia_ids = summary['AphiaIDs']
+    assert (aphia_ids['unique'], aphia_ids['cached'], aphia_ids['min_calls'], aphia_ids['max_calls']) == (1, 1, 0, 2)
+    assert summary['external IDs']['max_calls'] == 1
+    assert (summary['sites']['unique'], summary['sites']['cached'], summary['sites']['max_calls']) == (2, 1, 1)
+
+    # 7 calls at most: 6 to WoRMS, 1 to MarineRegions, 2 req/s each
+    assert plan.projected_seconds(summary) == 3.5
+    assert 'Projected wall time at the current rate limits: 2s - 4s' in plan.report()
+
+
+def test_format_seconds():
+    assert format_seconds(42) == '42s'
+    assert format_seconds(125) == '2m05s'
+    assert format_seconds(3 * 3600 + 61) == '3h01m01s'
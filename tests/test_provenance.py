@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""Tests for the `provenance` module."""
+
+import gzip
+
+import pandas as pd
+import pytest
+import rdflib
+from rdflib import URIRef, Literal
+
+from invasive_checker import provenance
+from invasive_checker.provenance import DWC, IC, aphia_iri, mrgid_iri
+
+
+def enriched_rows():
+    crab = pd.Series({'OTU': 'Otu 1', 'AccessionID': 'ERR1', 'Count': 4,
+                      'classification': 'Eukaryota;Arthropoda;Eriocheir sinensis',
+                      'latitude': 51.4, 'longitude': 3.5,
+                      'Aphia_ID': 107451, 'Worms SciName': 'Eriocheir sinensis', 'Worms SciName Rank': 'Species',
+                      'WRIMS Status at Sample Location': ['Introduced', 'Recorded'],
+                      'MarineRegions with known occurrence at Sample Location': [21912, 3293]})
+    absent = crab.copy()
+    absent['AccessionID'] = 'ERR2'
+    absent['Count'] = 0
+    unmatched = pd.Series({'OTU': 'Otu "2"', 'AccessionID': 'ERR1', 'Count': 1.0,
+                           'classification': 'Eukaryota;Something\nodd',
+                           'latitude': float('nan'), 'longitude': float('nan'),
+                           'Aphia_ID': 'No Match', 'Worms SciName': 'No Match', 'Worms SciName Rank': 'No Match'})
+    unrecorded = crab.copy()
+    unrecorded['OTU'] = 'Otu 3'
+    unrecorded['WRIMS Status at Sample Location'] = ['Unrecorded']
+    unrecorded['MarineRegions with known occurrence at Sample Location'] = ['None']
+    pending = unrecorded.copy()
+    pending['OTU'] = 'Otu 4'
+    pending['WRIMS Status at Sample Location'] = ['Pending']
+    return [crab, absent, unmatched, unrecorded, pending]
+
+
+@pytest.mark.parametrize('name, fmt', [('provenance.nt', 'nt'), ('provenance.ttl', 'turtle')])
+def test_rows_are_streamed_as_loadable_rdf(tmp_path, name, fmt):
+    path = str(tmp_path / name)
+    with provenance.TripleWriter(path, inputs={str(tmp_path / 'final_table.tsv'): 'abc123'}) as writer:
+        for row in enriched_rows():
+            writer.write_row(row)
+
+    graph = rdflib.Graph().parse(path, format=fmt)
+    assert len(graph) > 0
+
+    run = writer.run
+    assert (run, rdflib.RDF.type, rdflib.PROV.Activity) in graph
+    inputs = list(graph.objects(run, rdflib.PROV.used))
+    assert [graph.value(entity, IC.md5) for entity in inputs] == [Literal('abc123')]
+
+    occurrences = set(graph.subjects(rdflib.RDF.type, DWC.Occurrence))
+    # The zero count row is not an occurrence
+    assert len(occurrences) == 4
+    crab = writer.iri('occurrence', 'Otu 1', 'ERR1')
+    assert graph.value(crab, DWC.taxonID) == aphia_iri(107451)
+    assert graph.value(writer.iri('otu', 'Otu 1'), IC.aphia) == aphia_iri(107451)
+
+    statuses = {graph.value(assessment, DWC.locationID): graph.value(assessment, DWC.establishmentMeans)
+                for assessment in graph.subjects(IC.occurrence, crab)}
+    assert statuses == {mrgid_iri(21912): Literal('Introduced'), mrgid_iri(3293): Literal('Recorded')}
+    assessment = next(graph.subjects(DWC.locationID, mrgid_iri(21912)))
+    sources = set(graph.objects(assessment, rdflib.PROV.wasDerivedFrom))
+    assert URIRef('http://www.marinespecies.org/rest/AphiaDistributionsByAphiaID/107451') in sources
+    # Unrecorded/Pending placeholders are not establishmentMeans
+    assert set(graph.objects(None, DWC.establishmentMeans)) == {Literal('Introduced'), Literal('Recorded')}
+    for otu in ('Otu 3', 'Otu 4'):
+        assert list(graph.subjects(IC.occurrence, writer.iri('occurrence', otu, 'ERR1'))) == []
+
+    odd = writer.iri('otu', 'Otu "2"')
+    assert graph.value(odd, DWC.higherClassification) == Literal('Eukaryota;Something\nodd')
+    assert graph.value(odd, IC.aphia) is None
+
+
+def test_gzip_output(tmp_path):
+    path = str(tmp_path / 'provenance.nt.gz')
+    with provenance.TripleWriter(path) as writer:
+        writer.write_row(enriched_rows()[0])
+    with gzip.open(path, 'rt', encoding='utf8') as f:
+        graph = rdflib.Graph().parse(data=f.read(), format='nt')
+    assert len(graph) == writer.triples
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""Tests for the `proximity` module and the proximity fields of `check_aphia`."""
+
+import math
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import box
+from invasive_checker import invasive_checker
+from invasive_checker.geomstore import GeometryStore
+from invasive_checker.proximity import GEOD, ProximityEngine, geodesic_km
+
+TTL = '''
+@prefix gsp: <http://www.opengis.net/ont/geosparql#> .
+<http://marineregions.org/mrgid/21912/geometries?source=25> gsp:asWKT
+    "<http://www.opengis.net/def/crs/OGC/1.3/CRS84> POLYGON ((0 50, 5 50, 5 55, 0 55, 0 50))"^^gsp:wktLiteral .
+'''
+
+
+def test_nearest():
+    engine = ProximityEngine({1: box(0, 0, 1, 1), 2: box(0.5, 0.5, 2, 2), 3: box(10, 60, 20, 70), 4: None})
+    distance_km, nearest = engine.nearest([0.75, 0.5, 25], [0.75, -1, 65])
+
+    assert distance_km[0] == 0.0
+    assert sorted(nearest[0]) == [1, 2]
+    # One degree of latitude south of the box at the equator
+    assert distance_km[1] == pytest.approx(110.57, abs=0.1)
+    assert nearest[1] == [1]
+    # Five degrees of longitude at 65N
+    assert distance_km[2] == pytest.approx(236, abs=1)
+    assert list(engine.within([0.75, 0.5, 25], [0.75, -1, 65], 150)) == [True, True, False]
+    assert math.isnan(ProximityEngine({}).nearest([1], [1])[0][0])
+
+
+def test_nearest_across_the_antimeridian():
+    engine = ProximityEngine({1: box(179, 0, 180, 1), 2: box(170, 0, 171, 1)})
+    distance_km, nearest = engine.nearest([-179.9, 180.0], [0.5, 0.5])
+    # 0.1 degree of longitude at the equator, not 359 degrees the other way round
+    assert distance_km[0] == pytest.approx(11.13, abs=0.1)
+    assert nearest[0] == [1]
+    assert distance_km[1] == 0.0
+    assert nearest[1] == [1]
+
+
+def test_geodesic_km_to_a_slanted_edge_at_high_latitude():
+    region = shapely.from_wkt('POLYGON ((0 60, 2 61, 2 65, 0 65, 0 60))')
+    lons, lats = [1.6, 1.0, -3.0], [60.5, 59.0, 62.0]
+    distance_km = geodesic_km(shapely.points(lons, lats), np.array([region] * 3, dtype=object))
+
+    # Brute force: the nearest of many points along the boundary
+    boundary = shapely.segmentize(region.exterior, 0.0001)
+    edge_lons, edge_lats = shapely.get_coordinates(boundary).T
+    for lon, lat, km in zip(lons, lats, distance_km):
+        _, _, metres = GEOD.inv(np.full(len(edge_lons), lon), np.full(len(edge_lats), lat), edge_lons, edge_lats)
+        assert km == pytest.approx(metres.min() / 1000.0, abs=0.05)
+    assert distance_km[0] == pytest.approx(23.4, abs=0.1)
+
+
+def test_fetch_mrgid_geometry(monkeypatch):
+    class TtlReply:
+        status_code = 200
+        text = TTL
+    monkeypatch.setattr(invasive_checker, 'requester', lambda url, cached=True: TtlReply())
+    assert invasive_checker.fetch_mrgid_geometry(21912).equals(box(0, 50, 5, 55))
+
+
+def test_stored_geometries_bypass_the_lookup_cache(monkeypatch, tmp_path):
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        return invasive_checker.cache.CachedReply(url, 200, TTL)
+    monkeypatch.setattr(invasive_checker, 'fetch', fetch)
+    monkeypatch.setattr(invasive_checker, 'geom_store', GeometryStore(str(tmp_path)))
+    lookup_cache = invasive_checker.cache.LookupCache()
+    monkeypatch.setattr(invasive_checker, 'lookup_cache', lookup_cache)
+
+    assert invasive_checker.get_mrgid_geometry(21912).equals(box(0, 50, 5, 55))
+    assert invasive_checker.get_mrgid_geometry(21912).equals(box(0, 50, 5, 55))
+    # Fetched once into the store; the turtle reply isn't kept in the lookup cache
+    assert len(fetched) == 1
+    assert len(lookup_cache) == 0
+
+
+def test_failed_geometry_lookups_are_not_kept(monkeypatch):
+    replies = [None, box(0, 50, 5, 55)]
+    monkeypatch.setattr(invasive_checker, 'geom_store', None)
+    monkeypatch.setattr(invasive_checker, 'fetch_mrgid_geometry', lambda mrgid: replies.pop(0))
+    assert invasive_checker.get_mrgid_geometry(-21912) is None
+    assert invasive_checker.get_mrgid_geometry(-21912).equals(box(0, 50, 5, 55))
+    # Now it is kept
+    assert invasive_checker.get_mrgid_geometry(-21912).equals(box(0, 50, 5, 55))
+
+
+def test_check_aphia_buffer(canned, monkeypatch):
+    geoms = {21912: box(0, 50, 5, 55), 3293: box(2, 51, 3, 52), 4752: box(3.5, 51.2, 4, 51.5)}
+    monkeypatch.setattr(invasive_checker, 'get_mrgid_geometry', geoms.get)
+
+    status_dict, _ = invasive_checker.check_aphia(2.5, 51.5, 107451, details=False, buffer=10)
+    assert status_dict['sample location within <buffer> of aphia distribution'] is True
+    assert status_dict['distance [km] to nearest introduced location'] == 0.0
+    assert status_dict['nearest introduced MRGID'] == [21912]
+
+    far, near = invasive_checker.get_proximity([10, 5.5], [52, 52], 107451, 50)
+    assert far['sample location within <buffer> of aphia distribution'] is False
+    assert near['sample location within <buffer> of aphia distribution'] is True
+    assert near['distance [km] to nearest introduced location'] == pytest.approx(34.4, abs=0.5)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+"""Tests for the `ratelimit` module."""
+
+import time
+from invasive_checker import ratelimit
+
+URL = 'https://www.marinespecies.org/rest/AphiaDistributionsByAphiaID/107451'
+
+
+def test_parse_retry_after():
+    assert ratelimit.parse_retry_after('3') == 3.0
+    assert ratelimit.parse_retry_after(None) is None
+    assert ratelimit.parse_retry_after('not a date') is None
+    assert ratelimit.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+
+
+def test_backoff_and_recover():
+    limiter = ratelimit.RateLimiter(rate=4, max_rate=8)
+    limiter.backoff(URL)
+    assert limiter.current_rate(URL) == 2
+    for _ in range(50):
+        limiter.success(URL)
+    assert 2 < limiter.current_rate(URL) <= 8
+
+
+def test_host_names_of_one_upstream_share_a_bucket():
+    assert ratelimit.host_of(URL) == ratelimit.host_of('https://MarineSpecies.org/rest/AphiaRecordByExternalID/1') == \
+        'marinespecies.org'
+    limiter = ratelimit.RateLimiter(rate=4)
+    limiter.backoff('https://marinespecies.org/rest/AphiaRecordByExternalID/1')
+    assert limiter.current_rate(URL) == 2
+    assert limiter.current_rate('https://www.marineregions.org/rest/') == 4
+
+
+def test_retry_after_blocks_host():
+    limiter = ratelimit.RateLimiter(rate=100)
+    limiter.backoff(URL, retry_after='0.3')
+    start = time.time()
+    limiter.acquire(URL)
+    assert time.time() - start >= 0.25
+    # Other hosts are not affected
+    start = time.time()
+    limiter.acquire('https://www.marineregions.org/rest/')
+    assert time.time() - start < 0.1
+
+
+def test_acquire_timeout():
+    limiter = ratelimit.RateLimiter(rate=100)
+    limiter.backoff(URL, retry_after='30')
+    start = time.time()
+    assert limiter.acquire(URL, timeout=0.1) is False
+    assert time.time() - start < 0.1
+    assert limiter.acquire('https://www.marineregions.org/rest/', timeout=0.1) is True
+
+
+def test_shared_state_file(tmp_path):
+    state_file = str(tmp_path / 'ratelimit.json')
+    first = ratelimit.RateLimiter(rate=4, state_file=state_file)
+    second = ratelimit.RateLimiter(rate=4, state_file=state_file)
+    first.backoff(URL, retry_after='0')
+    assert second.current_rate(URL) == 2
+
+
+def test_only_successful_replies_raise_the_rate(monkeypatch):
+    from invasive_checker import invasive_checker
+    statuses = [503, 502, 200]
+
+    class Reply:
+        text = '{}'
+        headers = {}
+
+        def __init__(self, url, timeout=None):
+            self.url = url
+            self.status_code = statuses.pop(0)
+    limiter = ratelimit.RateLimiter(rate=10, max_rate=20)
+    monkeypatch.setattr(invasive_checker, 'limiter', limiter)
+    monkeypatch.setattr(invasive_checker.requests, 'get', Reply)
+    reply = invasive_checker.fetch(URL + '?test_only_successful_replies_raise_the_rate')
+    assert reply.status_code == 200
+    assert statuses == []
+    # One probe up for the 200, none for the server errors
+    assert limiter.current_rate(URL) == 10 + 0.5 / 10
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+"""Tests for the `site_index` module."""
+
+import pytest
+
+from invasive_checker import invasive_checker, cache
+from invasive_checker.site_index import SiteIndex
+
+
+@pytest.fixture
+def no_distribution(monkeypatch):
+    '''
+    WoRMS answered "204 No Content" for the distribution of 126436.
+    '''
+    lookup_cache = cache.LookupCache()
+    url = invasive_checker.distribution_url(126436)
+    lookup_cache._store(url, cache.CachedReply(url, 204, ''))
+    monkeypatch.setattr(invasive_checker, 'lookup_cache', lookup_cache)
+
+
+def test_check_site_matches_check_aphia(canned):
+    index = SiteIndex.from_aphia_ids([107451, 126436])
+    statuses = index.check_site(2.5, 51.5, [107451, 126436])
+
+    assert statuses[107451] == {'Status': ['Recorded', 'Introduced'], 'Within': [3293, 21912]}
+    assert statuses[126436] == invasive_checker.check_aphia(2.5, 51.5, 126436)[0]
+
+
+def test_round_trip(canned, no_distribution, tmp_path):
+    index = SiteIndex.from_aphia_ids([107451, 126436])
+    index.to_json(tmp_path / 'index.json')
+    stored = SiteIndex.from_json(tmp_path / 'index.json')
+
+    assert stored.index == index.index
+    assert stored.statuses({21912, 4752}, [107451]) == {107451: {'Status': ['Native', 'Introduced'],
+                                                                 'Within': [4752, 21912]}}
+    assert stored.missing == {126436}
+
+
+def test_failed_lookups_are_not_marked_missing(canned, monkeypatch):
+    # Nothing from WoRMS for 126436: the lookup failed
+    monkeypatch.setattr(invasive_checker, 'lookup_cache', cache.LookupCache())
+    index = SiteIndex.from_aphia_ids([107451, 126436])
+    assert index.missing == set()
+    assert index.aphia_ids == {107451}
+
+    fetched = []
+    monkeypatch.setattr(invasive_checker, 'get_aphia_distribution', lambda aphia_id: fetched.append(aphia_id))
+    index.fetch([107451, 126436])
+    assert fetched == [126436]
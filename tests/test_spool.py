@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""Tests for the spool folder worker of `app/main.py`."""
+
+import os
+import json
+import importlib.util
+
+import pytest
+
+spec = importlib.util.spec_from_file_location('main', os.path.join(os.path.dirname(__file__), os.pardir, 'app', 'main.py'))
+main = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(main)
+
+
+def write_manifest(spool, name, output_folder, **extra):
+    path = spool / name
+    path.write_text(json.dumps(dict({'input_file': 'final_table.tsv', 'meta_file': 'meta.csv',
+                                     'output_folder': str(output_folder)}, **extra)))
+    return str(path)
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    jobs = []
+
+    def do_work(input_file, output_folder, meta_file, cfg):
+        if cfg.get('FAIL'):
+            raise ValueError('bad input')
+        jobs.append((input_file, output_folder, meta_file, cfg))
+    monkeypatch.setattr(main, 'do_work', do_work)
+    return jobs
+
+
+def test_process_job_claims_and_marks_done(tmp_path, jobs):
+    manifest = write_manifest(tmp_path, 'job1.json', tmp_path / 'out', cfg={'SEP': '\t'})
+    assert main.process_job(manifest, {'SEP': ',', 'BUFFER_KM': None}) is True
+    assert jobs == [('final_table.tsv', str(tmp_path / 'out'), 'meta.csv', {'SEP': '\t', 'BUFFER_KM': None})]
+
+    marker = json.loads((tmp_path / 'job1.done').read_text())
+    assert marker['status'] == 'done'
+    assert marker['manifest'] == 'job1.json'
+    assert sorted(os.listdir(tmp_path)) == ['job1.done', 'out']
+    # The job is gone: a second worker gets nothing
+    assert main.process_job(manifest, {}) is False
+    assert len(jobs) == 1
+
+
+def test_failed_job_is_marked_failed(tmp_path, jobs):
+    manifest = write_manifest(tmp_path, 'job1.json', tmp_path / 'out', cfg={'FAIL': True})
+    assert main.process_job(manifest, {}) is True
+    marker = json.loads((tmp_path / 'job1.failed').read_text())
+    assert marker['status'] == 'failed'
+    assert 'bad input' in marker['error']
+    assert not (tmp_path / 'job1.json.running').exists()
+
+
+def test_claims_of_long_queued_jobs_are_not_stale(tmp_path, monkeypatch):
+    manifest = write_manifest(tmp_path, 'job1.json', tmp_path / 'out')
+    # The job waited in the spool for longer than STALE_CLAIM_AFTER
+    os.utime(manifest, (1000, 1000))
+    recovered = []
+
+    def do_work(input_file, output_folder, meta_file, cfg):
+        # Another worker looks for dead workers while the job runs
+        recovered.append(main.recover_stale_claims(str(tmp_path)))
+    monkeypatch.setattr(main, 'do_work', do_work)
+    assert main.process_job(manifest, {}) is True
+    assert recovered == [0]
+    assert sorted(os.listdir(tmp_path)) == ['job1.done', 'out']
+
+
+def test_job_that_lost_its_claim_still_finishes(tmp_path, monkeypatch):
+    manifest = write_manifest(tmp_path, 'job1.json', tmp_path / 'out')
+
+    def do_work(input_file, output_folder, meta_file, cfg):
+        # Requeued by another worker that took the claim for stale
+        os.rename(manifest + '.running', manifest)
+    monkeypatch.setattr(main, 'do_work', do_work)
+    assert main.process_job(manifest, {}) is True
+    assert sorted(os.listdir(tmp_path)) == ['job1.done', 'job1.json', 'out']
+
+
+def test_manifests_claimed_while_listing_are_skipped(tmp_path, monkeypatch):
+    older = write_manifest(tmp_path, 'older.json', tmp_path)
+    newer = write_manifest(tmp_path, 'newer.json', tmp_path)
+    os.utime(older, (1000, 1000))
+    gone = str(tmp_path / 'gone.json')
+    real_glob = main.glob.glob
+    # Another worker renamed gone.json between the listing and the stat
+    monkeypatch.setattr(main.glob, 'glob', lambda pattern: real_glob(pattern) + [gone])
+    assert main.spool_manifests(str(tmp_path)) == [older, newer]
+
+
+def test_stale_claims_are_requeued_then_failed(tmp_path):
+    running = write_manifest(tmp_path, 'job1.json.running', tmp_path)
+    fresh = write_manifest(tmp_path, 'job2.json.running', tmp_path)
+    os.utime(running, (1000, 1000))
+
+    assert main.recover_stale_claims(str(tmp_path)) == 1
+    assert sorted(os.listdir(tmp_path)) == ['job1.json', 'job2.json.running']
+    assert json.loads((tmp_path / 'job1.json').read_text())['attempts'] == 1
+
+    # Its worker died again
+    os.rename(tmp_path / 'job1.json', running)
+    os.utime(running, (1000, 1000))
+    assert main.recover_stale_claims(str(tmp_path)) == 1
+    assert sorted(os.listdir(tmp_path)) == ['job1.failed', 'job2.json.running']
+    assert json.loads((tmp_path / 'job1.failed').read_text())['status'] == 'failed'
+    assert os.path.exists(fresh)
+
+
+def test_running_claims_are_kept_fresh(tmp_path):
+    running = write_manifest(tmp_path, 'job1.json.running', tmp_path)
+    os.utime(running, (1000, 1000))
+    stop = main.threading.Event()
+    thread = main.threading.Thread(target=main.keep_claim, args=(running, stop, 0.01))
+    thread.start()
+    stop.wait(0.1)
+    stop.set()
+    thread.join()
+    assert main.recover_stale_claims(str(tmp_path)) == 0
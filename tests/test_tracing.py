@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""Tests for the `tracing` module."""
+
+import json
+import pytest
+from invasive_checker import invasive_checker, tracing
+from invasive_checker.site_index import SiteIndex
+
+
+@pytest.fixture
+def trace_file(tmp_path):
+    path = tmp_path / 'trace.jsonl'
+    tracing.configure(str(path))
+    yield path
+    tracing.configure(None)
+
+
+def read_spans(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_spans_share_trace(canned, trace_file):
+    with tracing.span('process_input_row', OTU='otu_1'):
+        invasive_checker.check_aphia(2.5, 51.5, 107451, details=False)
+    invasive_checker.check_aphia(2.5, 51.5, 107451, details=False)
+
+    spans = read_spans(trace_file)
+    names = [span['name'] for span in spans]
+    assert names == ['get_aphia_distribution', 'get_mrgid_from_latlon', 'derive_status_records',
+                     'check_aphia', 'process_input_row',
+                     'get_aphia_distribution', 'get_mrgid_from_latlon', 'derive_status_records',
+                     'check_aphia']
+    first, second = spans[:5], spans[5:]
+    assert len(set(span['trace_id'] for span in first)) == 1
+    assert first[3]['parent_id'] == first[4]['span_id']
+    assert first[0]['parent_id'] == first[3]['span_id']
+    assert first[0]['attrs'] == {'cache': 'hit', 'aphia_id': 107451}
+    assert second[0]['trace_id'] != first[0]['trace_id']
+    assert all(span['duration_ms'] >= 0 for span in spans)
+
+
+def test_requester_marks_cache_miss(monkeypatch, trace_file):
+    class Reply:
+        status_code = 200
+        text = '{}'
+
+        def __init__(self, url, timeout=None):
+            self.url = url
+    monkeypatch.setattr(invasive_checker.requests, 'get', Reply)
+    url = 'https://www.marinespecies.org/rest/test_requester_marks_cache_miss'
+    for _ in range(2):
+        with tracing.span('lookup', cache='hit'):
+            invasive_checker.requester(url)
+
+    http, miss, hit = read_spans(trace_file)
+    assert http['name'] == 'http'
+    assert http['attrs'] == {'url': url, 'status': 200, 'attempts': 1}
+    assert miss['attrs']['cache'] == 'miss'
+    assert hit['attrs']['cache'] == 'hit'
+
+
+def test_worker_threads_share_the_trace(canned, trace_file):
+    with tracing.span('batch'):
+        SiteIndex.from_aphia_ids([107451, 126436])
+
+    *lookups, batch = read_spans(trace_file)
+    assert [span['name'] for span in lookups] == ['get_aphia_distribution'] * 2
+    assert all(span['trace_id'] == batch['trace_id'] for span in lookups)
+    assert all(span['parent_id'] == batch['span_id'] for span in lookups)